@@ -1,376 +1,2692 @@
+import bisect
+import hashlib
+import json
+import os
+import queue
+import random
+import sqlite3
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import parse_qsl, urlencode, urlsplit
+from zoneinfo import ZoneInfo
+
 import streamlit as st
 import pandas as pd
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-import mysql.connector
-from mysql.connector import Error
-from datetime import datetime
+import httplib2
+from mysql.connector import Error, pooling
+from mysql.connector.errors import PoolError
+from datetime import datetime, timedelta, timezone
 import isodate
 import plotly.express as px
 
+try:
+    import duckdb
+except ImportError:  # only needed for STORAGE_BACKEND=duckdb
+    duckdb = None
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+########################## METRICS #########################
+# Latency histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+# Counters and latency histograms keyed by metric name and labels, shared by every thread of the process
+class MetricsRegistry:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.started_at = utc_now()
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0.0,
+                                                     'count': 0}
+            histogram['buckets'][bisect.bisect_left(self.buckets, seconds)] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        # Plain JSON: saved with ingest jobs and exported from the Diagnostics page
+        with self._lock:
+            return {
+                'started_at': self.started_at.isoformat(),
+                'buckets': list(self.buckets),
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self._counters.items())],
+                'histograms': [{'name': name, 'labels': dict(labels), 'buckets': list(histogram['buckets']),
+                                'sum': histogram['sum'], 'count': histogram['count']}
+                               for (name, labels), histogram in sorted(self._histograms.items())]
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self.started_at = utc_now()
+
+
+@st.cache_resource(show_spinner=False)
+def get_metrics():
+    return MetricsRegistry()
+
+
+def prometheus_labels(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ''
+    escaped = {label: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for label, value in labels.items()}
+    return '{' + ','.join(f'{label}="{value}"' for label, value in escaped.items()) + '}'
+
+
+def metrics_to_prometheus(snapshot):
+    # Prometheus text exposition format, version 0.0.4
+    lines = []
+    typed = set()
+    for counter in snapshot['counters']:
+        if counter['name'] not in typed:
+            typed.add(counter['name'])
+            lines.append(f"# TYPE {counter['name']} counter")
+        lines.append(f"{counter['name']}{prometheus_labels(counter['labels'])} {counter['value']}")
+    for histogram in snapshot['histograms']:
+        name = histogram['name']
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for bound, count in zip([*snapshot['buckets'], '+Inf'], histogram['buckets']):
+            cumulative += count
+            lines.append(f"{name}_bucket{prometheus_labels(histogram['labels'], le=bound)} {cumulative}")
+        lines.append(f"{name}_sum{prometheus_labels(histogram['labels'])} {histogram['sum']}")
+        lines.append(f"{name}_count{prometheus_labels(histogram['labels'])} {histogram['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+def histogram_quantile(bounds, buckets, quantile):
+    # Upper bound of the bucket holding the quantile - as precise as the buckets allow
+    total = sum(buckets)
+    if not total:
+        return None
+    cumulative = 0
+    for bound, count in zip([*bounds, float('inf')], buckets):
+        cumulative += count
+        if cumulative >= quantile * total:
+            return bound
+
 
 ########################## FUNCTION BLOCK #########################
+YOUTUBE_HTTP_TIMEOUT = 30
+
+# Quota: the default daily budget of a YouTube Data API project, and what each call costs in units
+YOUTUBE_DAILY_QUOTA = int(os.environ.get('YOUTUBE_DAILY_QUOTA', 10000))
+YOUTUBE_UNITS_PER_SECOND = float(os.environ.get('YOUTUBE_UNITS_PER_SECOND', 20))
+QUOTA_COSTS = {'youtube.search.list': 100}  # every other list call costs 1 unit
+QUOTA_RESET_TIMEZONE = ZoneInfo('America/Los_Angeles')  # quota resets at midnight Pacific time
+
+# Retry with exponential backoff on throttling and server errors
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+YOUTUBE_MAX_RETRIES = 5
+YOUTUBE_BACKOFF_SECONDS = 1
+YOUTUBE_BACKOFF_MAX_SECONDS = 32
+
+DEFAULT_FETCH_WORKERS = 4
+
+# On-disk response cache: fresh entries are served without a request, stale ones are revalidated by ETag
+RESPONSE_CACHE_PATH = os.environ.get('YOUTUBE_CACHE_PATH', '.youtube_cache.sqlite3')
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('YOUTUBE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+RESPONSE_CACHE_TTLS = {  # seconds, per resource type
+    'youtube.channels.list': 6 * 3600,
+    'youtube.playlistItems.list': 15 * 60,
+    'youtube.videos.list': 3600,
+    'youtube.commentThreads.list': 3600,
+    'youtube.search.list': 3600
+}
+RESPONSE_CACHE_DEFAULT_TTL = 3600
+
+
+class QuotaExceededError(Exception):
+    pass
+
+
+# Units spent per API key and quota day, in SQLite next to the response cache, so ingest workers in separate
+# processes draw from one daily budget. Only a fingerprint of the key is stored.
+class QuotaLedger:
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS quota_usage (
+                api_key_fingerprint TEXT,
+                quota_day TEXT,
+                units INTEGER,
+                PRIMARY KEY (api_key_fingerprint, quota_day)
+            )
+        ''')
+
+    def charge(self, fingerprint, quota_day, units, budget):
+        # Returns the units used before this charge, and whether it fit in the budget. BEGIN IMMEDIATE takes
+        # the write lock before the read, so two processes can never both spend the last units.
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._connection.execute('SELECT units FROM quota_usage WHERE api_key_fingerprint = ? '
+                                               'AND quota_day = ?', (fingerprint, quota_day)).fetchone()
+                used = row[0] if row else 0
+                if used + units <= budget:
+                    self._connection.execute('''
+                        INSERT INTO quota_usage (api_key_fingerprint, quota_day, units) VALUES (?, ?, ?)
+                        ON CONFLICT (api_key_fingerprint, quota_day) DO UPDATE SET units = units + excluded.units
+                    ''', (fingerprint, quota_day, units))
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+        return used, used + units <= budget
+
+    def used(self, fingerprint, quota_day):
+        with self._lock:
+            row = self._connection.execute('SELECT units FROM quota_usage WHERE api_key_fingerprint = ? '
+                                           'AND quota_day = ?', (fingerprint, quota_day)).fetchone()
+        return row[0] if row else 0
+
+
+@st.cache_resource(show_spinner=False)
+def get_quota_ledger():
+    return QuotaLedger(RESPONSE_CACHE_PATH)
+
+
+# Token bucket refilled at units_per_second, plus a hard daily budget shared with every process using the key.
+# used_today counts the units this process spent.
+class QuotaRateLimiter:
+    def __init__(self, daily_budget, units_per_second, ledger, fingerprint):
+        self.daily_budget = daily_budget
+        self.units_per_second = units_per_second
+        self.ledger = ledger
+        self.fingerprint = fingerprint
+        # Large enough for the most expensive single call
+        self.capacity = max(units_per_second, max(QUOTA_COSTS.values()))
+        self.used_today = 0
+        self._day = self._quota_day()
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _quota_day():
+        return datetime.now(QUOTA_RESET_TIMEZONE).date()
+
+    def acquire(self, units):
+        with self._lock:
+            today = self._quota_day()
+            if today != self._day:
+                self._day = today
+                self.used_today = 0
+
+            used, charged = self.ledger.charge(self.fingerprint, today.isoformat(), units, self.daily_budget)
+            if not charged:
+                raise QuotaExceededError(
+                    f"Daily quota budget of {self.daily_budget} units would be exceeded "
+                    f"({used} used, {units} requested)")
+            self.used_today += units
+
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.units_per_second)
+            self._updated = now
+            # Reserve the units now and sleep off any debt outside the lock, so callers are served in order
+            self._tokens -= units
+            wait = -self._tokens / self.units_per_second if self._tokens < 0 else 0
+
+        if wait:
+            time.sleep(wait)
+
+    def remaining(self):
+        return self.daily_budget - self.ledger.used(self.fingerprint, self._quota_day().isoformat())
+
+
+@st.cache_resource(show_spinner=False)
+def get_quota_limiter(api_key):
+    return QuotaRateLimiter(YOUTUBE_DAILY_QUOTA, YOUTUBE_UNITS_PER_SECOND, get_quota_ledger(),
+                            api_key_fingerprint(api_key))
+
+
+# SQLite-backed cache keyed by endpoint + parameters, with size-bounded LRU eviction
+class ResponseCache:
+    def __init__(self, path, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS response_cache (
+                cache_key TEXT PRIMARY KEY,
+                etag TEXT,
+                body TEXT,
+                size INTEGER,
+                stored_at REAL,
+                accessed_at REAL
+            )
+        ''')
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS idx_response_cache_accessed_at ON response_cache (accessed_at)')
+        self._total_bytes = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM response_cache').fetchone()[0]
+
+    def get(self, cache_key):
+        with self._lock:
+            row = self._connection.execute('SELECT etag, body, stored_at FROM response_cache WHERE cache_key = ?',
+                                           (cache_key,)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute('UPDATE response_cache SET accessed_at = ? WHERE cache_key = ?',
+                                     (time.time(), cache_key))
+        return {'etag': row[0], 'body': json.loads(row[1]), 'stored_at': row[2]}
+
+    def put(self, cache_key, etag, body):
+        data = json.dumps(body)
+        now = time.time()
+        with self._lock:
+            previous = self._connection.execute('SELECT size FROM response_cache WHERE cache_key = ?',
+                                                (cache_key,)).fetchone()
+            self._connection.execute('''
+                INSERT OR REPLACE INTO response_cache (cache_key, etag, body, size, stored_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (cache_key, etag, data, len(data), now, now))
+            self._total_bytes += len(data) - (previous[0] if previous else 0)
+            self._evict()
+
+    def revalidated(self, cache_key):
+        # A 304 means the stored body is current again - restart its TTL
+        now = time.time()
+        with self._lock:
+            self._connection.execute('UPDATE response_cache SET stored_at = ?, accessed_at = ? WHERE cache_key = ?',
+                                     (now, now, cache_key))
+
+    def _evict(self):
+        # Drop least recently used entries until the cache is back under its size cap
+        while self._total_bytes > self.max_bytes:
+            rows = self._connection.execute(
+                'SELECT cache_key, size FROM response_cache ORDER BY accessed_at LIMIT 100').fetchall()
+            if not rows:
+                break
+            self._connection.executemany('DELETE FROM response_cache WHERE cache_key = ?',
+                                         [(row[0],) for row in rows])
+            self._total_bytes -= sum(row[1] for row in rows)
+
+
+@st.cache_resource(show_spinner=False)
+def get_response_cache():
+    return ResponseCache(RESPONSE_CACHE_PATH, RESPONSE_CACHE_MAX_BYTES)
+
+
+def response_cache_key(request):
+    # Endpoint plus sorted parameters; the API key is left out so it never lands on disk
+    query = urlsplit(request.uri).query
+    params = sorted((name, value) for name, value in parse_qsl(query) if name != 'key')
+    return f"{request.methodId}?{urlencode(params)}"
+
+
+# 0. YouTube client - built once per API key and shared by every fetch function across reruns
+@st.cache_resource(show_spinner=False)
+def get_youtube_client(api_key):
+    # static_discovery uses the discovery document bundled with the client library (no fetch/parse per call)
+    return build('youtube', 'v3', developerKey=api_key, static_discovery=True, cache_discovery=False)
+
+
+_thread_local = threading.local()
+
+
+def get_thread_http():
+    # httplib2.Http is not thread-safe, so each worker thread keeps its own keep-alive connection
+    if not hasattr(_thread_local, 'http'):
+        _thread_local.http = httplib2.Http(timeout=YOUTUBE_HTTP_TIMEOUT)
+    return _thread_local.http
+
+
+def execute_with_retries(api_key, request):
+    limiter = get_quota_limiter(api_key)
+    metrics = get_metrics()
+    units = QUOTA_COSTS.get(request.methodId, 1)
+
+    for attempt in range(YOUTUBE_MAX_RETRIES + 1):
+        # Every attempt is billed, so retries go through the limiter as well
+        limiter.acquire(units)
+        metrics.increment('youtube_quota_units_total', units, method=request.methodId)
+        try:
+            with metrics.timer('youtube_api_request_seconds', method=request.methodId):
+                return request.execute(http=get_thread_http())
+        except HttpError as e:
+            if e.resp.status not in RETRYABLE_STATUSES or attempt == YOUTUBE_MAX_RETRIES:
+                if e.resp.status != 304:
+                    metrics.increment('youtube_api_errors_total', method=request.methodId, status=e.resp.status)
+                raise
+            metrics.increment('youtube_api_retries_total', method=request.methodId, status=e.resp.status)
+            backoff = min(YOUTUBE_BACKOFF_MAX_SECONDS, YOUTUBE_BACKOFF_SECONDS * 2 ** attempt)
+            time.sleep(backoff + random.uniform(0, 1))
+
+
+def http_error_reason(error):
+    # First reason of the API's error body, e.g. 'commentsDisabled', 'quotaExceeded', 'videoNotFound'
+    details = getattr(error, 'error_details', None)
+    if isinstance(details, list) and details and isinstance(details[0], dict):
+        return details[0].get('reason')
+    return None
+
+
+def execute_request(api_key, request):
+    cache = get_response_cache()
+    metrics = get_metrics()
+    cache_key = response_cache_key(request)
+    cached = cache.get(cache_key)
+
+    if cached is not None:
+        ttl = RESPONSE_CACHE_TTLS.get(request.methodId, RESPONSE_CACHE_DEFAULT_TTL)
+        if time.time() - cached['stored_at'] < ttl:
+            metrics.increment('youtube_response_cache_total', method=request.methodId, result='hit')
+            return cached['body']
+        if cached['etag']:
+            request.headers['If-None-Match'] = cached['etag']
+
+    try:
+        response = execute_with_retries(api_key, request)
+    except HttpError as e:
+        # 304 Not Modified - the client library raises for every status >= 300
+        if e.resp.status == 304 and cached is not None:
+            cache.revalidated(cache_key)
+            metrics.increment('youtube_response_cache_total', method=request.methodId, result='revalidated')
+            return cached['body']
+        raise
+
+    metrics.increment('youtube_response_cache_total', method=request.methodId, result='miss')
+    cache.put(cache_key, response.get('etag'), response)
+    return response
+
+
 # 1. Channel
 def get_channel_details(api_key, channel_ids):
-    youtube = build('youtube', 'v3', developerKey=api_key)
+    youtube = get_youtube_client(api_key)
     request = youtube.channels().list(part='snippet,contentDetails,statistics,status', id=','.join(channel_ids))
-    response = request.execute()
+    response = execute_request(api_key, request)
     return response
 
 
 # 2. Playlist
-def get_playlist_items(api_key, playlist_id):
-    youtube = build('youtube', 'v3', developerKey=api_key)
-    request = youtube.playlistItems().list(part='snippet,contentDetails', playlistId=playlist_id, maxResults=10)
-    response = request.execute()
+def get_playlist_items(api_key, playlist_id, page_token=None):
+    youtube = get_youtube_client(api_key)
+    request = youtube.playlistItems().list(part='snippet,contentDetails', playlistId=playlist_id, maxResults=50,
+                                           pageToken=page_token)
+    response = execute_request(api_key, request)
     return response
 
 
+# 2a. Every page of a list call, one item at a time - pages are only requested as the caller consumes them
+def iter_pages(fetch_page):
+    page_token = None
+    while True:
+        response = fetch_page(page_token)
+        yield from response['items']
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            break
+
+
+def iter_playlist_items(api_key, playlist_id):
+    return iter_pages(lambda page_token: get_playlist_items(api_key, playlist_id, page_token))
+
+
 # 3. Video details
 def get_video_details(api_key, video_ids):
-    youtube = build('youtube', 'v3', developerKey=api_key)
+    youtube = get_youtube_client(api_key)
     request = youtube.videos().list(part='snippet,contentDetails,statistics', id=','.join(video_ids))
-    response = request.execute()
+    response = execute_request(api_key, request)
     return response
 
 
-# 4. Comments
-def get_comments(api_key, channel_ids):
-    youtube = build('youtube', 'v3', developerKey=api_key)
-    comments = []
+# 3a. Video details in batches - videos.list accepts up to 50 ids per call
+VIDEO_BATCH_SIZE = 50
+
+
+def collect_playlist_video_ids(playlist_items):
+    return [item['contentDetails']['videoId'] for item in playlist_items]
+
+
+def get_video_details_batched(api_key, video_ids, batch_size=VIDEO_BATCH_SIZE):
+    videos_by_id = {}
+    for start in range(0, len(video_ids), batch_size):
+        response = get_video_details(api_key, video_ids[start:start + batch_size])
+        for video in response['items']:
+            videos_by_id[video['id']] = video
+
+    # Keep playlistItems order; ids deleted/private since listing come back missing
+    videos = [videos_by_id[video_id] for video_id in video_ids if video_id in videos_by_id]
+    missing_ids = [video_id for video_id in video_ids if video_id not in videos_by_id]
+    return videos, missing_ids
+
+
+# 4. Comments - top-level threads with their first replies, and the full reply list of busier threads
+def get_comment_threads(api_key, video_id, page_token=None):
+    youtube = get_youtube_client(api_key)
+    request = youtube.commentThreads().list(part='snippet,replies', videoId=video_id, maxResults=100,
+                                            pageToken=page_token)
+    response = execute_request(api_key, request)
+    return response
+
+
+def get_comment_replies(api_key, parent_id, page_token=None):
+    youtube = get_youtube_client(api_key)
+    request = youtube.comments().list(part='snippet', parentId=parent_id, maxResults=100, pageToken=page_token)
+    response = execute_request(api_key, request)
+    return response
+
+
+# Yields (comment, parent comment id) pairs; parent id is None for top-level comments
+def iter_video_comments(api_key, video_id):
+    for thread in iter_pages(lambda page_token: get_comment_threads(api_key, video_id, page_token)):
+        top_level_comment = thread['snippet']['topLevelComment']
+        yield top_level_comment, None
+
+        # commentThreads embeds at most 5 replies; page through comments.list only when there are more
+        replies = thread.get('replies', {}).get('comments', [])
+        if thread['snippet'].get('totalReplyCount', 0) > len(replies):
+            replies = iter_pages(lambda page_token: get_comment_replies(api_key, top_level_comment['id'], page_token))
+        for reply in replies:
+            yield reply, top_level_comment['id']
+
+
+######################### NORMALIZATION OF API RESPONSES ##################################
+# Each batch of API items becomes one typed DataFrame; parsing and coercion run column-wise, not per row
+API_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+COUNT_COLUMNS = ['view_count', 'like_count', 'dislike_count', 'favorite_count', 'comment_count']
+VIDEO_COLUMNS = ['video_id', 'channel_id', 'playlist_id', 'video_name', 'video_description', 'published_date',
+                 'view_count', 'like_count', 'dislike_count', 'favorite_count', 'comment_count', 'duration',
+                 'thumbnail', 'caption_status']
+COMMENT_COLUMNS = ['channel_id', 'comment_id', 'video_id', 'parent_id', 'comment_text', 'comment_author',
+                   'comment_published_date']
+# ISO 8601 durations as YouTube returns them, e.g. PT1H2M3S, P1DT2H, P0D
+ISO_DURATION_PATTERN = r'^P(?:(?P<days>\d+)D)?(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?(?:(?P<seconds>\d+(?:\.\d+)?)S)?)?$'
+
+
+def parse_api_datetimes(values):
+    return pd.to_datetime(pd.Series(values, dtype=object), format=API_DATETIME_FORMAT, errors='coerce')
+
+
+def parse_counts(values):
+    # Missing statistics ('N/A' or absent) count as 0
+    return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').fillna(0).astype('int64')
+
+
+def parse_durations(values):
+    durations = pd.Series(values, dtype=object).fillna('')
+    parts = durations.str.extract(ISO_DURATION_PATTERN).astype('float64')
+    seconds = (parts['days'].fillna(0) * 86400 + parts['hours'].fillna(0) * 3600
+               + parts['minutes'].fillna(0) * 60 + parts['seconds'].fillna(0))
+
+    # Anything the pattern does not cover (weeks, years, ...) falls back to isodate, row by row
+    unmatched = ~durations.str.match(ISO_DURATION_PATTERN)
+    if unmatched.any():
+        seconds[unmatched] = [isodate.parse_duration(value).total_seconds() if value else 0
+                              for value in durations[unmatched]]
+    return seconds.round().astype('int64')
+
+
+def normalize_videos(items, channel_id, playlist_id):
+    snippets = [item['snippet'] for item in items]
+    statistics = [item.get('statistics', {}) for item in items]
+    content_details = [item['contentDetails'] for item in items]
 
-    for channel_id in channel_ids:
-        # Channel title
-        channel_request = youtube.channels().list(part='snippet', id=channel_id)
-        channel_response = channel_request.execute()
-        channel_title = channel_response['items'][0]['snippet']['title']
+    videos = pd.DataFrame({
+        'video_id': pd.Series([item['id'] for item in items], dtype=object),
+        'channel_id': channel_id,
+        'playlist_id': playlist_id,
+        'video_name': pd.Series([snippet['title'] for snippet in snippets], dtype=object),
+        'video_description': pd.Series([snippet.get('description', 'N/A') for snippet in snippets], dtype=object),
+        'published_date': parse_api_datetimes([snippet['publishedAt'] for snippet in snippets]),
+        'duration': parse_durations([details['duration'] for details in content_details]),
+        'thumbnail': pd.Series([snippet['thumbnails']['default']['url'] for snippet in snippets], dtype=object),
+        'caption_status': pd.Series([details.get('caption', 'N/A') for details in content_details], dtype=object)
+    })
+    for column, field in zip(COUNT_COLUMNS, ['viewCount', 'likeCount', 'dislikeCount', 'favoriteCount',
+                                             'commentCount']):
+        videos[column] = parse_counts([stats.get(field) for stats in statistics])
+    return videos[VIDEO_COLUMNS]
 
-        # Retrieve - latest videos from each channel
-        videos_request = youtube.search().list(part='snippet', channelId=channel_id, type='video', order='date',
-                                               maxResults=10)
-        videos_response = videos_request.execute()
 
-        for video in videos_response['items']:
-            video_id = video['id']['videoId']
+def normalize_comments(comments, channel_id, video_id):
+    snippets = [comment['snippet'] for comment, _ in comments]
+    frame = pd.DataFrame({
+        'channel_id': channel_id,
+        'comment_id': pd.Series([comment['id'] for comment, _ in comments], dtype=object),
+        'video_id': video_id,
+        'parent_id': pd.Series([parent_id for _, parent_id in comments], dtype=object),
+        'comment_text': pd.Series([snippet['textDisplay'] for snippet in snippets], dtype=object),
+        'comment_author': pd.Series([snippet['authorDisplayName'] for snippet in snippets], dtype=object),
+        'comment_published_date': parse_api_datetimes([snippet['publishedAt'] for snippet in snippets])
+    })
+    return frame[COMMENT_COLUMNS]
 
+
+def frame_rows(frame, columns):
+    # Column-wise conversion to plain Python values for the MySQL connector: no numpy scalars, NaN/NaT -> NULL
+    values = []
+    for column in columns:
+        series = frame[column]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            series = series.dt.strftime('%Y-%m-%d %H:%M:%S')
+        values.append(series.astype(object).where(series.notna(), None).tolist())
+    return list(zip(*values))
+
+
+######################### INGEST PIPELINE ##################################
+# Rows are handed to storage in chunks of this many videos (or comments) as soon as they are fetched
+INGEST_CHUNK_SIZE = 200
+COMMENT_CHUNK_SIZE = 1000
+# Incremental sync re-fetches statistics of videos published within this many days
+DEFAULT_RECENCY_WINDOW_DAYS = 7
+
+
+def iter_batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def new_chunk(channels=(), playlists=(), videos=None, comments=None, comment_sync=(), sync_state=(),
+              missing_video_ids=(), comments_disabled_video_ids=()):
+    return {
+        'channels': list(channels),
+        'playlists': list(playlists),
+        'videos': videos if videos is not None else normalize_videos([], None, None),
+        'comments': comments if comments is not None else normalize_comments([], None, None),
+        'comment_sync': list(comment_sync),
+        'sync_state': list(sync_state),
+        'missing_video_ids': list(missing_video_ids),
+        'comments_disabled_video_ids': list(comments_disabled_video_ids)
+    }
+
+
+def build_channel_record(channel):
+    return {
+        'channel_id': channel['id'],
+        'channel_name': channel['snippet']['title'],
+        'channel_type': channel['snippet'].get('type', 'N/A'),
+        'channel_views': int(channel['statistics'].get('viewCount', 0)),
+        'channel_description': channel['snippet'].get('description', 'N/A'),
+        'channel_status': channel['status'].get('privacyStatus', 'N/A')
+    }
+
+
+def iter_new_playlist_items(playlist_items, cutoff):
+    # The uploads playlist is newest first, so paging stops at the first item older than the cutoff.
+    # Timestamps share one fixed-width format, so comparing the strings compares the instants.
+    cutoff_text = cutoff.strftime(API_DATETIME_FORMAT) if cutoff is not None else None
+    for item in playlist_items:
+        published_at = item['contentDetails'].get('videoPublishedAt')
+        if cutoff_text is not None and published_at and published_at < cutoff_text:
+            return
+        yield item
+
+
+def iter_video_comment_chunks(api_key, video, chunk_size=COMMENT_CHUNK_SIZE):
+    comment_count = video['comment_count']
+    comments = iter_video_comments(api_key, video['video_id']) if comment_count else ()
+    comment_ids = set()
+
+    def comment_sync():
+        # stored_comment_count feeds the DuckDB backend's per-video rollup; pages can overlap, so ids are counted
+        return [{'channel_id': video['channel_id'], 'video_id': video['video_id'], 'comment_count': comment_count,
+                 'stored_comment_count': len(comment_ids)}]
+
+    try:
+        for comments_batch in iter_batches(comments, chunk_size):
+            with get_metrics().timer('ingest_stage_seconds', stage='normalize_comments'):
+                frame = normalize_comments(comments_batch, video['channel_id'], video['video_id'])
+            comment_ids.update(frame['comment_id'])
+            yield new_chunk(comments=frame)
+    except HttpError as e:
+        # Recorded as synced so later runs do not ask again until the count moves. Any other error -
+        # quotaExceeded and rateLimitExceeded are 403s too - fails the run, and the video stays unsynced.
+        reason = http_error_reason(e)
+        if e.resp.status == 403 and reason == 'commentsDisabled':
+            yield new_chunk(comment_sync=comment_sync(), comments_disabled_video_ids=[video['video_id']])
+            return
+        if e.resp.status == 404 and reason == 'videoNotFound':
+            # Deleted since its details were fetched
+            yield new_chunk(comment_sync=comment_sync(), missing_video_ids=[video['video_id']])
+            return
+        raise
+
+    # Only marked synced once every comment of the video has been handed to storage
+    yield new_chunk(comment_sync=comment_sync())
+
+
+def iter_merged_comment_chunks(chunks, chunk_size=COMMENT_CHUNK_SIZE):
+    # Most videos have a handful of comments: their chunks are merged up to chunk_size rows, so storage
+    # sees one large write instead of two small ones per video. A video's comment_sync entry still
+    # follows its last comments, in the same or a later chunk.
+    frames, comment_sync, missing_video_ids, disabled_video_ids = [], [], [], []
+    rows = 0
+    for chunk in chunks:
+        if len(chunk['comments']):
+            frames.append(chunk['comments'])
+        comment_sync.extend(chunk['comment_sync'])
+        missing_video_ids.extend(chunk['missing_video_ids'])
+        disabled_video_ids.extend(chunk['comments_disabled_video_ids'])
+        rows += len(chunk['comments']) + len(chunk['comment_sync'])
+        if rows >= chunk_size:
+            yield new_chunk(comments=pd.concat(frames, ignore_index=True) if frames else None,
+                            comment_sync=comment_sync, missing_video_ids=missing_video_ids,
+                            comments_disabled_video_ids=disabled_video_ids)
+            frames, comment_sync, missing_video_ids, disabled_video_ids = [], [], [], []
+            rows = 0
+    if rows or missing_video_ids or disabled_video_ids:
+        yield new_chunk(comments=pd.concat(frames, ignore_index=True) if frames else None,
+                        comment_sync=comment_sync, missing_video_ids=missing_video_ids,
+                        comments_disabled_video_ids=disabled_video_ids)
+
+
+def iter_comment_chunks(api_key, videos, synced_comment_counts, chunk_size=COMMENT_CHUNK_SIZE, workers=1):
+    # Skip videos whose comment_count has not moved since their comments were last stored
+    synced = videos['video_id'].map(synced_comment_counts)
+    changed = synced.isna() | (synced != videos['comment_count'])
+    pending = videos.loc[changed, ['video_id', 'channel_id', 'comment_count']].astype(object).to_dict('records')
+
+    def produce(video):
+        return iter_video_comment_chunks(api_key, video, chunk_size)
+
+    if workers <= 1:
+        chunks = (chunk for video in pending for chunk in produce(video))
+    else:
+        # Comment threads of the channel's videos are fetched concurrently
+        chunks = iter_concurrently(pending, produce, workers)
+    yield from iter_merged_comment_chunks(chunks, chunk_size)
+
+
+def iter_channel_chunks(api_key, channel, chunk_size=INGEST_CHUNK_SIZE, watermark=None, recency_window=None,
+                        comment_sync_lookup=None, workers=1):
+    channel_record = build_channel_record(channel)
+    channel_id = channel_record['channel_id']
+    playlist_id = channel['contentDetails']['relatedPlaylists']['uploads']
+
+    # Incremental: new videos since the watermark, plus videos inside the recency window for fresh statistics
+    cutoff = None
+    if watermark is not None:
+        cutoff = watermark
+        if recency_window is not None:
+            cutoff = min(cutoff, datetime.now(timezone.utc).replace(tzinfo=None) - recency_window)
+
+    # Parent rows go first so the video foreign keys resolve when the first video chunk lands
+    yield new_chunk(channels=[channel_record],
+                    playlists=[{'playlist_id': playlist_id, 'channel_id': channel_id, 'playlist_name': 'Uploads'}])
+
+    metrics = get_metrics()
+    latest_published = watermark
+    playlist_items = iter_new_playlist_items(iter_playlist_items(api_key, playlist_id), cutoff)
+    for items in iter_batches(playlist_items, chunk_size):
+        with metrics.timer('ingest_stage_seconds', stage='fetch_videos'):
+            video_items, missing_ids = get_video_details_batched(api_key, collect_playlist_video_ids(items))
+        with metrics.timer('ingest_stage_seconds', stage='normalize_videos'):
+            videos = normalize_videos(video_items, channel_id, playlist_id)
+        if len(videos) and videos['published_date'].notna().any():
+            published = videos['published_date'].max().to_pydatetime()
+            if latest_published is None or published > latest_published:
+                latest_published = published
+        yield new_chunk(videos=videos, missing_video_ids=missing_ids)
+
+        # Comments of the videos already collected, instead of another channel lookup and search.list
+        if comment_sync_lookup is not None:
+            with metrics.timer('ingest_stage_seconds', stage='comment_sync_lookup'):
+                synced_comment_counts = comment_sync_lookup(videos['video_id'].tolist())
+            yield from iter_comment_chunks(api_key, videos, synced_comment_counts, workers=workers)
+
+    # Written with the channel's last chunk, so a failed run never advances the watermark
+    yield new_chunk(sync_state=[{'channel_id': channel_id, 'last_published_date': latest_published,
+                                 'last_synced_at': datetime.now(timezone.utc).replace(tzinfo=None)}])
+
+
+def iter_concurrently(items, produce, workers):
+    # Bounded queue: producers block while storage catches up, so memory stays flat
+    results = queue.Queue(maxsize=workers * 2)
+    stop = threading.Event()
+
+    def put(entry):
+        while not stop.is_set():
             try:
-                # Retrieve comments for each video
-                comments_request = youtube.commentThreads().list(part='snippet', videoId=video_id, maxResults=10)
-                comments_response = comments_request.execute()
-
-                for comment in comments_response['items']:
-                    if comment['snippet']['topLevelComment']['snippet']['videoId'] == video_id:
-                        comment_data = {
-                            'channel_title': channel_title,
-                            'channel_id': channel_id,
-                            'comment_id': comment['id'],
-                            'video_id': video_id,
-                            'comment_text': comment['snippet']['topLevelComment']['snippet']['textDisplay'],
-                            'comment_author': comment['snippet']['topLevelComment']['snippet']['authorDisplayName'],
-                            'comment_published_date': comment['snippet']['topLevelComment']['snippet']['publishedAt']
-                        }
-                        comments.append(comment_data)
-            except HttpError as e:
-                if e.resp.status == 403:
-                    # Skip videos with disabled comments
-                    st.warning(f"Comments are disabled for video: {video_id}")
-                else:
-                    raise
+                results.put(entry, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def run(item):
+        try:
+            for result in produce(item):
+                if stop.is_set():
+                    return
+                put(('result', result))
+        except Exception as e:
+            put(('error', e))
+        finally:
+            put(('done', None))
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for item in items:
+            executor.submit(run, item)
 
-    return comments
+        pending = len(items)
+        while pending:
+            kind, value = results.get()
+            if kind == 'done':
+                pending -= 1
+            elif kind == 'error':
+                # First failure (e.g. QuotaExceededError) stops the whole run
+                raise value
+            else:
+                yield value
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_ingest_chunks(api_key, channel_ids, chunk_size=INGEST_CHUNK_SIZE, workers=1, watermarks=None,
+                       recency_window=None, comment_sync_lookup=None):
+    channel_details = get_channel_details(api_key, channel_ids)
+    channels = channel_details['items']
+    watermarks = watermarks or {}
+
+    # One budget for both levels: channels run side by side and split what is left for their comment
+    # threads, so at most `workers` fetches run at once rather than workers squared
+    channel_workers = max(1, min(workers, len(channels)))
+    comment_workers = max(1, workers // channel_workers)
+
+    def produce(channel):
+        return iter_channel_chunks(api_key, channel, chunk_size, watermarks.get(channel['id']), recency_window,
+                                   comment_sync_lookup, comment_workers)
+
+    if channel_workers <= 1:
+        for channel in channels:
+            yield from produce(channel)
+    else:
+        # Chunks of one channel keep their order; chunks of different channels interleave
+        yield from iter_concurrently(channels, produce, channel_workers)
 
 
 ######################### STORAGE OF FETCHED DATA IN MYSQL ##################################
-def store_data_in_mysql(channels, playlists, videos, comments):
-    try:
-        connection = mysql.connector.connect(
-            host='localhost',
-            database='youtube_data',
-            user='root',
-            password='root'
+# Rows per multi-row upsert; each batch is committed in its own transaction
+MYSQL_BATCH_SIZE = int(os.environ.get('MYSQL_BATCH_SIZE', 1000))
+# Optional bulk mode: batches at least this large go through a staging table filled by LOAD DATA LOCAL INFILE
+MYSQL_USE_LOAD_DATA = os.environ.get('MYSQL_USE_LOAD_DATA', '0') == '1'
+MYSQL_LOAD_DATA_MIN_ROWS = int(os.environ.get('MYSQL_LOAD_DATA_MIN_ROWS', 500))
+
+MYSQL_CONFIG = {
+    'host': os.environ.get('MYSQL_HOST', 'localhost'),
+    'port': int(os.environ.get('MYSQL_PORT', 3306)),
+    'database': os.environ.get('MYSQL_DATABASE', 'youtube_data'),
+    'user': os.environ.get('MYSQL_USER', 'root'),
+    'password': os.environ.get('MYSQL_PASSWORD', 'root'),
+    'allow_local_infile': MYSQL_USE_LOAD_DATA
+}
+MYSQL_POOL_SIZE = int(os.environ.get('MYSQL_POOL_SIZE', 10))  # mysql-connector allows at most 32
+MYSQL_POOL_TIMEOUT = 10  # seconds to wait for a free pooled connection
+
+
+# One pool per server process, shared by every session, page and rerun
+@st.cache_resource(show_spinner=False)
+def get_mysql_pool():
+    return pooling.MySQLConnectionPool(pool_name='youtube_data', pool_size=MYSQL_POOL_SIZE, pool_reset_session=True,
+                                       **MYSQL_CONFIG)
+
+
+def get_mysql_connection():
+    # close() on the returned connection hands it back to the pool
+    pool = get_mysql_pool()
+    deadline = time.monotonic() + MYSQL_POOL_TIMEOUT
+    while True:
+        try:
+            connection = pool.get_connection()
+            break
+        except PoolError:
+            # Pool exhausted - wait for another session to return a connection
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.05)
+
+    # Health check on checkout: reconnects connections the server dropped while they sat idle
+    connection.ping(reconnect=True, attempts=2, delay=0)
+    return connection
+
+
+############### CREATION OF TABLES ###########
+def create_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS channel (
+            channel_id VARCHAR(255) PRIMARY KEY,
+            channel_name VARCHAR(255),
+            channel_type VARCHAR(255),
+            channel_views BIGINT,
+            channel_description TEXT,
+            channel_status VARCHAR(255)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS playlist (
+            playlist_id VARCHAR(255) PRIMARY KEY,
+            channel_id VARCHAR(255),
+            playlist_name VARCHAR(255),
+            FOREIGN KEY (channel_id) REFERENCES channel(channel_id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS video (
+            video_id VARCHAR(255) PRIMARY KEY,
+            channel_id VARCHAR(255),
+            playlist_id VARCHAR(255),
+            video_name VARCHAR(255),
+            video_description TEXT,
+            published_date DATETIME,
+            view_count BIGINT,
+            like_count BIGINT,
+            dislike_count BIGINT,
+            favorite_count BIGINT,
+            comment_count BIGINT,
+            duration INT,
+            thumbnail VARCHAR(255),
+            caption_status VARCHAR(255),
+            FOREIGN KEY (channel_id) REFERENCES channel(channel_id),
+            FOREIGN KEY (playlist_id) REFERENCES playlist(playlist_id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Comment (
+            channel_id VARCHAR(255),
+            comment_id VARCHAR(255) PRIMARY KEY,
+            video_id VARCHAR(255),
+            comment_text TEXT,
+            comment_author VARCHAR(255),
+            comment_published_date DATETIME,
+            FOREIGN KEY (channel_id) REFERENCES channel(channel_id)
+
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            channel_id VARCHAR(255) PRIMARY KEY,
+            last_published_date DATETIME,
+            last_synced_at DATETIME,
+            FOREIGN KEY (channel_id) REFERENCES channel(channel_id)
+        )
+    ''')
+
+
+############### SCHEMA MIGRATIONS ###########
+# Per-channel aggregates read by the analysis page; refreshed when a channel's ingest finishes
+CHANNEL_ROLLUP_REFRESH = '''
+    INSERT INTO channel_rollup (channel_id, video_count, total_views, avg_duration, comment_count)
+    SELECT channel.channel_id, COALESCE(videos.video_count, 0), COALESCE(videos.total_views, 0),
+           COALESCE(videos.avg_duration, 0), COALESCE(comments.comment_count, 0)
+    FROM channel
+    LEFT JOIN (
+        SELECT channel_id, COUNT(*) AS video_count, SUM(view_count) AS total_views, AVG(duration) AS avg_duration
+        FROM video
+        {video_filter}
+        GROUP BY channel_id
+    ) AS videos ON videos.channel_id = channel.channel_id
+    LEFT JOIN (
+        SELECT channel_id, COUNT(*) AS comment_count
+        FROM Comment
+        {comment_filter}
+        GROUP BY channel_id
+    ) AS comments ON comments.channel_id = channel.channel_id
+    {channel_filter}
+    ON DUPLICATE KEY UPDATE
+        video_count = VALUES(video_count),
+        total_views = VALUES(total_views),
+        avg_duration = VALUES(avg_duration),
+        comment_count = VALUES(comment_count)
+'''
+
+# Stored comments per video, for paging videos by comment count without aggregating the Comment table.
+# Refreshed for a video once all its comments are stored (its comment_sync entry); counts use idx_comment_video.
+VIDEO_COMMENT_ROLLUP_REFRESH = '''
+    INSERT INTO video_comment_rollup (video_id, comment_count)
+    SELECT video_id, COUNT(*)
+    FROM Comment
+    {comment_filter}
+    GROUP BY video_id
+    ON DUPLICATE KEY UPDATE
+        comment_count = VALUES(comment_count)
+'''
+
+# (version, description, statements) - applied in order and recorded in schema_migrations.
+# Shipped migrations are never edited; append a new one instead.
+SCHEMA_MIGRATIONS = [
+    (1, 'Indexes on the analysis sort and filter columns', [
+        'CREATE INDEX idx_video_view_count ON video (view_count)',
+        'CREATE INDEX idx_video_like_count ON video (like_count)',
+        'CREATE INDEX idx_video_comment_count ON video (comment_count)',
+        'CREATE INDEX idx_video_published_date_channel ON video (published_date, channel_id)',
+        # Covers the rollup refresh so it reads only index entries of the touched channels
+        'CREATE INDEX idx_video_channel_rollup ON video (channel_id, view_count, duration)',
+        '''
+            ALTER TABLE video
+                ADD COLUMN total_reactions BIGINT AS (like_count + dislike_count) STORED,
+                ADD INDEX idx_video_total_reactions (total_reactions)
+        ''',
+        'CREATE INDEX idx_comment_video ON Comment (video_id)'
+    ]),
+    (2, 'Per-channel rollup table', [
+        '''
+            CREATE TABLE IF NOT EXISTS channel_rollup (
+                channel_id VARCHAR(255) PRIMARY KEY,
+                video_count BIGINT,
+                total_views BIGINT,
+                avg_duration DOUBLE,
+                comment_count BIGINT,
+                FOREIGN KEY (channel_id) REFERENCES channel(channel_id)
+            )
+        ''',
+        CHANNEL_ROLLUP_REFRESH.format(video_filter='', comment_filter='', channel_filter='')
+    ]),
+    (3, 'Comment replies and per-video comment sync marker', [
+        'ALTER TABLE Comment ADD COLUMN parent_id VARCHAR(255) NULL',
+        # comment_count at the time the video's comments were last stored in full
+        'ALTER TABLE video ADD COLUMN comments_synced_count BIGINT NULL'
+    ]),
+    (4, 'Full-text indexes for search', [
+        # InnoDB keeps FULLTEXT indexes up to date as rows are inserted and updated
+        'ALTER TABLE Comment ADD FULLTEXT INDEX ft_comment_text (comment_text)',
+        'ALTER TABLE video ADD FULLTEXT INDEX ft_video_text (video_name, video_description)'
+    ]),
+    (5, 'Per-video comment count rollup', [
+        '''
+            CREATE TABLE IF NOT EXISTS video_comment_rollup (
+                video_id VARCHAR(255) PRIMARY KEY,
+                comment_count BIGINT,
+                INDEX idx_video_comment_rollup_count (comment_count, video_id),
+                FOREIGN KEY (video_id) REFERENCES video(video_id)
+            )
+        ''',
+        VIDEO_COMMENT_ROLLUP_REFRESH.format(comment_filter='')
+    ])
+]
+
+# Re-running a half-applied migration: the index, column or table already exists
+IGNORED_MIGRATION_ERRNOS = {1050, 1060, 1061}
+
+
+def apply_migrations(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            description VARCHAR(255),
+            applied_at DATETIME
         )
+    ''')
+    cursor.execute('SELECT version FROM schema_migrations')
+    applied = {version for (version,) in cursor.fetchall()}
 
-        if connection.is_connected():
-            cursor = connection.cursor()
-
-            ############### CREATION OF TABLES ###########
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS channel (
-                    channel_id VARCHAR(255) PRIMARY KEY,
-                    channel_name VARCHAR(255),
-                    channel_type VARCHAR(255),
-                    channel_views BIGINT,
-                    channel_description TEXT,
-                    channel_status VARCHAR(255)
-                )
-            ''')
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS playlist (
-                    playlist_id VARCHAR(255) PRIMARY KEY,
-                    channel_id VARCHAR(255),
-                    playlist_name VARCHAR(255),
-                    FOREIGN KEY (channel_id) REFERENCES channel(channel_id)
-                )
-            ''')
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS video (
-                    video_id VARCHAR(255) PRIMARY KEY,
-                    channel_id VARCHAR(255),
-                    playlist_id VARCHAR(255),
-                    video_name VARCHAR(255),
-                    video_description TEXT,
-                    published_date DATETIME,
-                    view_count BIGINT,
-                    like_count BIGINT,
-                    dislike_count BIGINT,
-                    favorite_count BIGINT,
-                    comment_count BIGINT,
-                    duration INT,
-                    thumbnail VARCHAR(255),
-                    caption_status VARCHAR(255),
-                    FOREIGN KEY (channel_id) REFERENCES channel(channel_id),
-                    FOREIGN KEY (playlist_id) REFERENCES playlist(playlist_id)
-                )
-            ''')
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS Comment (
-                    channel_id VARCHAR(255),
-                    comment_id VARCHAR(255) PRIMARY KEY,
-                    video_id VARCHAR(255),
-                    comment_text TEXT,
-                    comment_author VARCHAR(255),
-                    comment_published_date DATETIME,
-                    FOREIGN KEY (channel_id) REFERENCES channel(channel_id)
-
-                )
-            ''')
-
-            ############## DATA INSERTION INTO TABLES ######################
-            for channel in channels:
-                cursor.execute('''
-                    INSERT INTO channel (channel_id, channel_name, channel_type, channel_views, channel_description, channel_status)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                    ON DUPLICATE KEY UPDATE
-                        channel_name = VALUES(channel_name),
-                        channel_type = VALUES(channel_type),
-                        channel_views = VALUES(channel_views),
-                        channel_description = VALUES(channel_description),
-                        channel_status = VALUES(channel_status)
-                ''', (channel['channel_id'], channel['channel_name'], channel['channel_type'], channel['channel_views'],
-                      channel['channel_description'], channel['channel_status']))
-
-            for playlist in playlists:
-                cursor.execute('''
-                    INSERT INTO playlist (playlist_id, channel_id, playlist_name)
-                    VALUES (%s, %s, %s)
-                    ON DUPLICATE KEY UPDATE
-                        playlist_name = VALUES(playlist_name)
-                ''', (playlist['playlist_id'], playlist['channel_id'], playlist['playlist_name']))
-
-            for video in videos:
-                published_date = datetime.strptime(video['published_date'], "%Y-%m-%dT%H:%M:%SZ").strftime(
-                    "%Y-%m-%d %H:%M:%S")
-                view_count = int(video['view_count']) if video['view_count'] != 'N/A' else 0
-                like_count = int(video['like_count']) if video['like_count'] != 'N/A' else 0
-                dislike_count = int(video['dislike_count']) if video['dislike_count'] != 'N/A' else 0
-                favorite_count = int(video['favorite_count']) if video['favorite_count'] != 'N/A' else 0
-                comment_count = int(video['comment_count']) if video['comment_count'] != 'N/A' else 0
-
-                cursor.execute('''
-                    INSERT INTO video (video_id, channel_id, playlist_id, video_name, video_description, published_date, view_count, like_count, dislike_count, favorite_count, comment_count, duration, thumbnail, caption_status)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ON DUPLICATE KEY UPDATE
-                        video_name = VALUES(video_name),
-                        video_description = VALUES(video_description),
-                        published_date = VALUES(published_date),
-                        view_count = VALUES(view_count),
-                        like_count = VALUES(like_count),
-                        dislike_count = VALUES(dislike_count),
-                        favorite_count = VALUES(favorite_count),
-                        comment_count = VALUES(comment_count),
-                        duration = VALUES(duration),
-                        thumbnail = VALUES(thumbnail),
-                        caption_status = VALUES(caption_status)
-                ''', (video['video_id'], video['channel_id'], video['playlist_id'], video['video_name'],
-                      video['video_description'], published_date, view_count, like_count, dislike_count, favorite_count,
-                      comment_count, video['duration'], video['thumbnail'], video['caption_status']))
-
-            # Data Insertion
-            for comment in comments:
-                # Check if the video ID exists in the video table
-                cursor.execute('SELECT COUNT(*) FROM video WHERE video_id = %s', (comment['video_id'],))
-                video_exists = cursor.fetchone()[0]
-
-                if video_exists:
-                    comment_published_date = datetime.strptime(comment['comment_published_date'],
-                                                               "%Y-%m-%dT%H:%M:%SZ").strftime("%Y-%m-%d %H:%M:%S")
-                    # Insert comment data
-                    cursor.execute('''
-                        INSERT INTO Comment (channel_id, comment_id, video_id, comment_text, comment_author, comment_published_date)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                        ON DUPLICATE KEY UPDATE
-                            comment_text = VALUES(comment_text),
-                            comment_author = VALUES(comment_author),
-                            comment_published_date = VALUES(comment_published_date)
-                    ''', (
-                        comment['channel_id'], comment['comment_id'], comment['video_id'], comment['comment_text'],
-                        comment['comment_author'],
-                        comment_published_date
-                    ))
-                else:
-                    print(
-                        f"Video with ID {comment['video_id']} does not exist in the video table. Skipping comment insertion.")
+    for version, description, statements in SCHEMA_MIGRATIONS:
+        if version in applied:
+            continue
+        for statement in statements:
+            try:
+                cursor.execute(statement)
+            except Error as e:
+                if e.errno not in IGNORED_MIGRATION_ERRNOS:
+                    raise
+        cursor.execute('INSERT INTO schema_migrations (version, description, applied_at) VALUES (%s, %s, NOW())',
+                       (version, description))
 
 
+# Tables and migrations are checked once per server process instead of on every write
+@st.cache_resource(show_spinner=False)
+def ensure_schema():
+    connection = get_mysql_connection()
+    try:
+        cursor = connection.cursor()
+        # Serialise concurrent app instances and ingest workers migrating the same database
+        cursor.execute("SELECT GET_LOCK('youtube_data_schema', 60)")
+        cursor.fetchall()
+        try:
+            create_tables(cursor)
+            apply_migrations(cursor)
             connection.commit()
-            st.success("Data stored in MySQL database successfully!")
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK('youtube_data_schema')")
+            cursor.fetchall()
+            cursor.close()
+    finally:
+        connection.close()
+    return True
 
 
-    except Error as e:
-        st.error(f"Error connecting to MySQL: {e}")
+def refresh_channel_rollups(cursor, channel_ids):
+    channel_ids = sorted(channel_ids)
+    if not channel_ids:
+        return
+    placeholders = ', '.join(['%s'] * len(channel_ids))
+    with get_metrics().timer('db_statement_seconds', backend='mysql', statement='refresh channel_rollup'):
+        cursor.execute(CHANNEL_ROLLUP_REFRESH.format(video_filter=f'WHERE channel_id IN ({placeholders})',
+                                                     comment_filter=f'WHERE channel_id IN ({placeholders})',
+                                                     channel_filter=f'WHERE channel.channel_id IN ({placeholders})'),
+                       tuple(channel_ids) * 3)
 
+
+def refresh_video_comment_rollups(cursor, video_ids):
+    for batch in iter_batches(sorted(video_ids), MYSQL_BATCH_SIZE):
+        placeholders = ', '.join(['%s'] * len(batch))
+        with get_metrics().timer('db_statement_seconds', backend='mysql', statement='refresh video_comment_rollup'):
+            cursor.execute(VIDEO_COMMENT_ROLLUP_REFRESH.format(comment_filter=f'WHERE video_id IN ({placeholders})'),
+                           tuple(batch))
+
+
+# Per-channel high-water marks for incremental sync
+def load_sync_state(channel_ids):
+    ensure_schema()
+    connection = get_mysql_connection()
+    try:
+        cursor = connection.cursor()
+        placeholders = ', '.join(['%s'] * len(channel_ids))
+        with get_metrics().timer('db_statement_seconds', backend='mysql', statement='select sync_state'):
+            cursor.execute(f'SELECT channel_id, last_published_date FROM sync_state '
+                           f'WHERE channel_id IN ({placeholders})', tuple(channel_ids))
+        watermarks = {channel_id: last_published_date for channel_id, last_published_date in cursor.fetchall()}
+        cursor.close()
     finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
+        connection.close()
+    return watermarks
+
+
+# comment_count of each video when its comments were last stored in full
+def load_comment_sync_counts(video_ids):
+    ensure_schema()
+    connection = get_mysql_connection()
+    try:
+        cursor = connection.cursor()
+        synced_counts = {}
+        for batch in iter_batches(video_ids, MYSQL_BATCH_SIZE):
+            placeholders = ', '.join(['%s'] * len(batch))
+            with get_metrics().timer('db_statement_seconds', backend='mysql', statement='select comments_synced_count'):
+                cursor.execute(f'SELECT video_id, comments_synced_count FROM video '
+                               f'WHERE video_id IN ({placeholders})', tuple(batch))
+                synced_counts.update(cursor.fetchall())
+        cursor.close()
+    finally:
+        connection.close()
+    return synced_counts
+
+
+############## DATA INSERTION INTO TABLES ######################
+# Table -> (insert columns, columns refreshed on duplicate key)
+UPSERT_COLUMNS = {
+    'channel': (['channel_id', 'channel_name', 'channel_type', 'channel_views', 'channel_description',
+                 'channel_status'],
+                ['channel_name', 'channel_type', 'channel_views', 'channel_description', 'channel_status']),
+    'playlist': (['playlist_id', 'channel_id', 'playlist_name'],
+                 ['playlist_name']),
+    'video': (['video_id', 'channel_id', 'playlist_id', 'video_name', 'video_description', 'published_date',
+               'view_count', 'like_count', 'dislike_count', 'favorite_count', 'comment_count', 'duration', 'thumbnail',
+               'caption_status'],
+              ['video_name', 'video_description', 'published_date', 'view_count', 'like_count', 'dislike_count',
+               'favorite_count', 'comment_count', 'duration', 'thumbnail', 'caption_status']),
+    'Comment': (['channel_id', 'comment_id', 'video_id', 'parent_id', 'comment_text', 'comment_author',
+                 'comment_published_date'],
+                ['parent_id', 'comment_text', 'comment_author', 'comment_published_date']),
+    'sync_state': (['channel_id', 'last_published_date', 'last_synced_at'],
+                   ['last_published_date', 'last_synced_at'])
+}
+
+
+def upsert_sql(table):
+    columns, update_columns = UPSERT_COLUMNS[table]
+    return f"""
+        INSERT INTO {table} ({', '.join(columns)})
+        VALUES ({', '.join(['%s'] * len(columns))})
+        ON DUPLICATE KEY UPDATE
+            {', '.join(f'{column} = VALUES({column})' for column in update_columns)}
+    """
+
+
+def load_data_value(value):
+    # LOAD DATA defaults: tab-separated, backslash escapes, \N for NULL
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+
+def load_data_upsert(cursor, table, rows):
+    columns, update_columns = UPSERT_COLUMNS[table]
+    staging = f"{table}_staging"
+    # Same column types, but none of the keys: LIKE would copy the FULLTEXT indexes, which InnoDB refuses on
+    # temporary tables (error 1796)
+    cursor.execute(f"CREATE TEMPORARY TABLE IF NOT EXISTS {staging} "
+                   f"SELECT {', '.join(columns)} FROM {table} WHERE FALSE")
+    cursor.execute(f"TRUNCATE TABLE {staging}")
+
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', newline='', suffix='.tsv', delete=False) as infile:
+        for row in rows:
+            infile.write('\t'.join(load_data_value(value) for value in row) + '\n')
+    try:
+        cursor.execute(f"LOAD DATA LOCAL INFILE %s INTO TABLE {staging} CHARACTER SET utf8mb4 ({', '.join(columns)})",
+                       (infile.name,))
+    finally:
+        os.remove(infile.name)
+
+    cursor.execute(f"""
+        INSERT INTO {table} ({', '.join(columns)})
+        SELECT {', '.join(columns)} FROM {staging} AS staged
+        ON DUPLICATE KEY UPDATE
+            {', '.join(f'{column} = staged.{column}' for column in update_columns)}
+    """)
+
+
+def write_rows(connection, cursor, table, rows, batch_size=MYSQL_BATCH_SIZE):
+    metrics = get_metrics()
+    for batch in iter_batches(rows, batch_size):
+        with metrics.timer('db_statement_seconds', backend='mysql', statement=f'upsert {table}'):
+            if MYSQL_USE_LOAD_DATA and len(batch) >= MYSQL_LOAD_DATA_MIN_ROWS:
+                load_data_upsert(cursor, table, batch)
+            else:
+                # executemany rewrites this into one multi-row INSERT per batch
+                cursor.executemany(upsert_sql(table), batch)
+            connection.commit()
+        metrics.increment('db_rows_written_total', len(batch), backend='mysql', table=table)
+
+
+def existing_video_ids(cursor, video_ids, batch_size=MYSQL_BATCH_SIZE):
+    # One set-based lookup per batch of ids instead of a SELECT per comment
+    existing = set()
+    video_ids = list(video_ids)
+    for batch in iter_batches(video_ids, batch_size):
+        placeholders = ', '.join(['%s'] * len(batch))
+        with get_metrics().timer('db_statement_seconds', backend='mysql', statement='select video ids'):
+            cursor.execute(f'SELECT video_id FROM video WHERE video_id IN ({placeholders})', tuple(batch))
+            existing.update(video_id for (video_id,) in cursor.fetchall())
+    return existing
+
+
+def write_data_to_mysql(channels, playlists, videos, comments, sync_state=(), comment_sync=()):
+    ensure_schema()
+    connection = get_mysql_connection()
+    try:
+        cursor = connection.cursor()
+
+        write_rows(connection, cursor, 'channel',
+                   [tuple(channel[column] for column in UPSERT_COLUMNS['channel'][0]) for channel in channels])
+        write_rows(connection, cursor, 'playlist',
+                   [tuple(playlist[column] for column in UPSERT_COLUMNS['playlist'][0]) for playlist in playlists])
+        write_rows(connection, cursor, 'video', frame_rows(videos, UPSERT_COLUMNS['video'][0]))
+
+        if len(comments):
+            known_video_ids = existing_video_ids(cursor, comments['video_id'].unique())
+            known = comments['video_id'].isin(known_video_ids)
+            if not known.all():
+                print(f"{int((~known).sum())} comments belong to videos that do not exist in the video table. "
+                      f"Skipping their insertion.")
+            comments = comments[known]
+            write_rows(connection, cursor, 'Comment', frame_rows(comments, UPSERT_COLUMNS['Comment'][0]))
+
+        if comment_sync:
+            with get_metrics().timer('db_statement_seconds', backend='mysql', statement='update comments_synced_count'):
+                cursor.executemany('UPDATE video SET comments_synced_count = %s WHERE video_id = %s',
+                                   [(sync['comment_count'], sync['video_id']) for sync in comment_sync])
+                connection.commit()
+            refresh_video_comment_rollups(cursor, {sync['video_id'] for sync in comment_sync})
+            connection.commit()
+
+        # Once per channel, with its last chunk - refreshing on every chunk re-aggregates the channel each time
+        refresh_channel_rollups(cursor, {state['channel_id'] for state in sync_state})
+        connection.commit()
+
+        write_rows(connection, cursor, 'sync_state',
+                   [tuple(state[column] for column in UPSERT_COLUMNS['sync_state'][0]) for state in sync_state])
+        cursor.close()
+
+    finally:
+        connection.close()
+        # Batches commit one by one, so even a failed call may have changed data - invalidate cached results
+        get_data_generation().bump()
 
 
 ##################### AUTOMATIC QUERY RUN TO DISPLAY RESULTS IN STREAMLIT #############################
+ANALYSIS_QUERIES = {
+    "Video Names and Corresponding Channels": '''
+        SELECT video_name, channel_name
+        FROM video
+        JOIN channel ON video.channel_id = channel.channel_id
+    ''',
+    "Channels with Most Videos": '''
+        SELECT channel_name, video_count
+        FROM channel_rollup
+        JOIN channel ON channel_rollup.channel_id = channel.channel_id
+        WHERE video_count > 0
+        ORDER BY video_count DESC
+    ''',
+    "Top 10 Most Viewed Videos": '''
+        SELECT video_name, view_count
+        FROM video
+        ORDER BY view_count DESC
+        LIMIT 10
+    ''',
+    "Comments on Each Video": '''
+        SELECT video_name, video_comment_rollup.comment_count
+        FROM video_comment_rollup
+        JOIN video ON video.video_id = video_comment_rollup.video_id
+        WHERE video_comment_rollup.comment_count > 0
+        ORDER BY video_comment_rollup.comment_count DESC
+    ''',
+    "Videos with Highest Likes": '''
+        SELECT video_name, like_count
+        FROM video
+        ORDER BY like_count DESC
+        LIMIT 10
+    ''',
+    "Total Likes and Dislikes for Each Video": '''
+        SELECT video_name, like_count, dislike_count
+        FROM video
+        ORDER BY total_reactions DESC
+    ''',
+    "Total Views for Each Channel": '''
+        SELECT channel_name, total_views
+        FROM channel_rollup
+        JOIN channel ON channel_rollup.channel_id = channel.channel_id
+        WHERE video_count > 0
+        ORDER BY total_views DESC
+    ''',
+    "Channels with Videos Published in 2024": '''
+        SELECT channel_name, COUNT(*) AS video_count
+        FROM video
+        JOIN channel ON video.channel_id = channel.channel_id
+        WHERE published_date >= '2024-01-01' AND published_date < '2025-01-01'
+        GROUP BY channel_name
+    ''',
+    "Average Duration of Videos in Each Channel": '''
+        SELECT channel_name, avg_duration
+        FROM channel_rollup
+        JOIN channel ON channel_rollup.channel_id = channel.channel_id
+        WHERE video_count > 0
+        ORDER BY avg_duration DESC
+    ''',
+    "Videos with Highest Number of Comments": '''
+        SELECT video_name, comment_count
+        FROM video
+        ORDER BY comment_count DESC
+        LIMIT 10
+    '''
+}
+
+# Queries with a row per video are paged instead of loaded in full. Keyset pagination: 'sql' takes {keyset}
+# (empty on the first page, else 'keyset' comparing the sort key to the previous page's last row, whose
+# values are read from the 'key' columns; {n} stands for key column n) and {limit}. Keysets are spelled
+# out as x < a OR (x = a AND id < b): MySQL cannot turn a row constructor comparison into an index range.
+# 'chart' and 'total' feed a top-N-plus-Other chart.
+PAGED_QUERIES = {
+    "Video Names and Corresponding Channels": {
+        'sql': '''
+            SELECT video.video_id, video_name, channel_name
+            FROM video
+            JOIN channel ON video.channel_id = channel.channel_id
+            {keyset}
+            ORDER BY video.video_id
+            {limit}
+        ''',
+        'keyset': 'WHERE video.video_id > {0}',
+        'key': ['video_id'],
+        'chart': '''
+            SELECT channel_name, video_count
+            FROM channel_rollup
+            JOIN channel ON channel_rollup.channel_id = channel.channel_id
+            WHERE video_count > 0
+            ORDER BY video_count DESC
+            LIMIT {limit}
+        ''',
+        'total': '''
+            SELECT SUM(video_count) AS video_count
+            FROM channel_rollup
+        '''
+    },
+    "Comments on Each Video": {
+        'sql': '''
+            SELECT video_comment_rollup.video_id, video_name, video_comment_rollup.comment_count
+            FROM video_comment_rollup
+            JOIN video ON video.video_id = video_comment_rollup.video_id
+            WHERE video_comment_rollup.comment_count > 0
+            {keyset}
+            ORDER BY video_comment_rollup.comment_count DESC, video_comment_rollup.video_id DESC
+            {limit}
+        ''',
+        'keyset': '''
+            AND (video_comment_rollup.comment_count < {0}
+                 OR (video_comment_rollup.comment_count = {0} AND video_comment_rollup.video_id < {1}))
+        ''',
+        'key': ['comment_count', 'video_id'],
+        'chart': '''
+            SELECT video_name, video_comment_rollup.comment_count
+            FROM video_comment_rollup
+            JOIN video ON video.video_id = video_comment_rollup.video_id
+            ORDER BY video_comment_rollup.comment_count DESC
+            LIMIT {limit}
+        ''',
+        'total': '''
+            SELECT SUM(comment_count) AS comment_count
+            FROM video_comment_rollup
+        '''
+    },
+    "Total Likes and Dislikes for Each Video": {
+        'sql': '''
+            SELECT video_id, video_name, like_count, dislike_count, total_reactions
+            FROM video
+            {keyset}
+            ORDER BY total_reactions DESC, video_id DESC
+            {limit}
+        ''',
+        'keyset': 'WHERE total_reactions < {0} OR (total_reactions = {0} AND video_id < {1})',
+        'key': ['total_reactions', 'video_id'],
+        'chart': '''
+            SELECT video_name, like_count, dislike_count
+            FROM video
+            ORDER BY total_reactions DESC
+            LIMIT {limit}
+        ''',
+        'total': '''
+            SELECT SUM(like_count) AS like_count, SUM(dislike_count) AS dislike_count
+            FROM video
+        '''
+    }
+}
+PAGE_SIZES = [50, 100, 500, 1000]
+CHART_TOP_N = 20
+CSV_CHUNK_ROWS = 5000
+CSV_EXPORT_MAX_ROWS = int(os.environ.get('CSV_EXPORT_MAX_ROWS', 100000))
+
+# Query results are cached per data generation; the generation is bumped after every ingest
+QUERY_CACHE_MAX_BYTES = int(os.environ.get('QUERY_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+
+class DataGeneration:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def bump(self):
+        with self._lock:
+            self.value += 1
+
+    def observe(self, marker):
+        # Writes made by ingest workers in other processes show up as a changed marker
+        with self._lock:
+            if marker != getattr(self, '_marker', None):
+                self._marker = marker
+                self.value += 1
+
+
+@st.cache_resource(show_spinner=False)
+def get_data_generation():
+    return DataGeneration()
+
+
+# LRU of (DataFrame, Plotly figure) per (query name, data generation), bounded by estimated memory
+class QueryResultCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        get_metrics().increment('query_cache_requests_total', result='miss' if entry is None else 'hit')
+        return None if entry is None else (entry[0], entry[1])
+
+    def put(self, key, df, fig):
+        # The figure carries the same columns as the frame, so count the frame twice
+        size = (2 if fig is not None else 1) * int(df.memory_usage(deep=True).sum())
+        generation = key[1]  # keys are (query name, data generation, ...)
+        with self._lock:
+            # Results of older generations can never be served again
+            for stale_key in [k for k in self._entries if k[1] != generation or k == key]:
+                self.total_bytes -= self._entries.pop(stale_key)[2]
+            self._entries[key] = (df, fig, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+
+@st.cache_resource(show_spinner=False)
+def get_query_result_cache():
+    return QueryResultCache(QUERY_CACHE_MAX_BYTES)
+
+
+def run_query(query, params=None):
+    ensure_schema()
+    connection = get_mysql_connection()
+    try:
+        cursor = connection.cursor()
+        with get_metrics().timer('db_statement_seconds', backend='mysql', statement='query'):
+            cursor.execute(query, params)
+            result = cursor.fetchall()
+        df = pd.DataFrame(result, columns=[i[0] for i in cursor.description])
+        cursor.close()
+    finally:
+        connection.close()
+    return df
+
+
+def iter_query(query, params=None, chunk_size=MYSQL_BATCH_SIZE):
+    # Unbuffered cursor: rows come off the socket one chunk at a time
+    ensure_schema()
+    connection = get_mysql_connection()
+    try:
+        cursor = connection.cursor()
+        with get_metrics().timer('db_statement_seconds', backend='mysql', statement='streamed query'):
+            cursor.execute(query, params)
+        columns = [i[0] for i in cursor.description]
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield pd.DataFrame(rows, columns=columns)
+        cursor.close()
+    finally:
+        connection.close()
+
+
+def build_query_figure(query_name, df):
+    # Generate graphs using Plotly
+    if query_name == "Video Names and Corresponding Channels":
+        fig = px.bar(df, x='channel_name', y='video_count',
+                     title="Video Names and Corresponding Channels")
+    elif query_name == "Channels with Most Videos":
+        fig = px.bar(df, x='channel_name', y='video_count', title="Channels with Most Videos")
+    elif query_name == "Top 10 Most Viewed Videos":
+        fig = px.bar(df, x='video_name', y='view_count', title="Top 10 Most Viewed Videos")
+    elif query_name == "Comments on Each Video":
+        fig = px.bar(df, x='video_name', y='comment_count', title="Comments on Each Video")
+    elif query_name == "Videos with Highest Likes":
+        fig = px.bar(df, x='video_name', y='like_count', title="Videos with Highest Likes")
+    elif query_name == "Total Likes and Dislikes for Each Video":
+        fig = px.bar(df, x='video_name', y=['like_count', 'dislike_count'],
+                     title="Total Likes and Dislikes for Each Video", barmode='group')
+    elif query_name == "Total Views for Each Channel":
+        fig = px.bar(df, x='channel_name', y='total_views', title="Total Views for Each Channel")
+    elif query_name == "Channels with Videos Published in 2024":
+        fig = px.bar(df, x='channel_name', y='video_count',
+                     title="Channels with Videos Published in 2024")
+    elif query_name == "Average Duration of Videos in Each Channel":
+        fig = px.bar(df, x='channel_name', y='avg_duration',
+                     title="Average Duration of Videos in Each Channel")
+    elif query_name == "Videos with Highest Number of Comments":
+        fig = px.bar(df, x='video_name', y='comment_count',
+                     title="Videos with Highest Number of Comments")
+
+    return fig
+
+
+def paged_query_sql(query_name, after, limit, placeholder):
+    paged = PAGED_QUERIES[query_name]
+    keyset, params = '', None
+    if after is not None:
+        # One parameter per marker, in the order the keyset uses the key values
+        fields = [field for _, field, _, _ in string.Formatter().parse(paged['keyset']) if field is not None]
+        keyset = paged['keyset'].format(*[placeholder] * len(paged['key']))
+        params = [after[int(field)] for field in fields]
+    return paged['sql'].format(keyset=keyset, limit=f'LIMIT {int(limit)}' if limit else ''), params
+
+
+def fetch_page(backend, query_name, after, page_size):
+    sql, params = paged_query_sql(query_name, after, page_size, backend.placeholder)
+    return backend.query(sql, params)
+
+
+def fetch_chart_data(backend, query_name, top_n=CHART_TOP_N):
+    # The top N rows, plus one 'Other' row holding whatever the totals have left over
+    paged = PAGED_QUERIES[query_name]
+    top = backend.query(paged['chart'].format(limit=int(top_n)))
+    totals = backend.query(paged['total'])
+    label_column, value_columns = top.columns[0], list(top.columns[1:])
+    top[value_columns] = top[value_columns].apply(pd.to_numeric)
+    other = {column: (pd.to_numeric(totals[column]).fillna(0).iloc[0] - top[column].sum()) for column in value_columns}
+    if any(value > 0 for value in other.values()):
+        top = pd.concat([top, pd.DataFrame([{label_column: 'Other', **other}])], ignore_index=True)
+    return top
+
+
+def write_query_csv(backend, query_name, max_rows=CSV_EXPORT_MAX_ROWS):
+    # Rows come from the database in chunks, but Streamlit keeps the finished download in memory (another
+    # copy on every click), so the export stops at max_rows
+    sql, params = paged_query_sql(query_name, None, max_rows, backend.placeholder)
+    parts = [chunk.to_csv(header=number == 0, index=False).encode('utf-8')
+             for number, chunk in enumerate(backend.iter_query(sql, params, CSV_CHUNK_ROWS))]
+    return b''.join(parts)
+
+
+def show_paged_result(backend, cache, generation, query_name):
+    page_size = st.selectbox("Rows per page", PAGE_SIZES, index=1, key='analysis-page-size')
+
+    # Cursor (last sort key of the previous page) of every page up to the current one; restart on new data
+    state_key = f"page-cursors-{query_name}"
+    if st.session_state.get(f"{state_key}-view") != (generation, page_size):
+        st.session_state[f"{state_key}-view"] = (generation, page_size)
+        st.session_state[state_key] = [None]
+    cursors = st.session_state[state_key]
+
+    page_key = (query_name, generation, 'page', cursors[-1], page_size)
+    metrics = get_metrics()
+    cached = cache.get(page_key)
+    if cached is None:
+        with metrics.timer('analysis_stage_seconds', stage='query', query=query_name):
+            df = fetch_page(backend, query_name, cursors[-1], page_size)
+        cache.put(page_key, df, None)
+    else:
+        df, _ = cached
+
+    with metrics.timer('analysis_stage_seconds', stage='render', query=query_name):
+        st.dataframe(df)
+    previous_column, page_column, next_column = st.columns(3)
+    if previous_column.button("Previous page", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    page_column.write(f"Page {len(cursors)}")
+    if next_column.button("Next page", disabled=len(df) < page_size):
+        cursors.append(frame_rows(df.tail(1), PAGED_QUERIES[query_name]['key'])[0])
+        st.rerun()
+
+    chart_key = (query_name, generation, 'chart')
+    cached = cache.get(chart_key)
+    if cached is None:
+        with metrics.timer('analysis_stage_seconds', stage='chart query', query=query_name):
+            chart_df = fetch_chart_data(backend, query_name)
+        with metrics.timer('analysis_stage_seconds', stage='figure', query=query_name):
+            fig = build_query_figure(query_name, chart_df)
+        cache.put(chart_key, chart_df, fig)
+    else:
+        _, fig = cached
+    with metrics.timer('analysis_stage_seconds', stage='render', query=query_name):
+        st.plotly_chart(fig)
+
+    # Built only when clicked
+    st.download_button(f"Download as CSV (first {CSV_EXPORT_MAX_ROWS:,} rows)",
+                       data=lambda: write_query_csv(backend, query_name),
+                       file_name=f"{query_name.lower().replace(' ', '_')}.csv", mime='text/csv')
+
+
 def run_queries_and_display():
-    connection = None
+    st.header("Query Results")
+    cache = get_query_result_cache()
+    data_generation = get_data_generation()
+    data_generation.observe(ingest_jobs_marker())
+    generation = data_generation.value
+
+    backend = get_storage_backend()
+    for query_name in ANALYSIS_QUERIES:
+        if st.button(query_name):
+            # Remembered across reruns, so paging through a result keeps it on screen
+            st.session_state['analysis-query'] = query_name
+
+    query_name = st.session_state.get('analysis-query')
+    if query_name is None:
+        return
+
+    st.subheader(query_name)
+    metrics = get_metrics()
     try:
-        connection = mysql.connector.connect(
-            host='localhost',  # Change to your host
-            database='youtube_data',  # Change to your database name
-            user='root',  # Change to your MySQL user
-            password='root'  # Change to your MySQL password
+        if query_name in PAGED_QUERIES:
+            show_paged_result(backend, cache, generation, query_name)
+            return
+
+        cached = cache.get((query_name, generation))
+        if cached is None:
+            with metrics.timer('analysis_stage_seconds', stage='query', query=query_name):
+                df = backend.run_query(query_name)
+            with metrics.timer('analysis_stage_seconds', stage='figure', query=query_name):
+                fig = build_query_figure(query_name, df)
+            cache.put((query_name, generation), df, fig)
+        else:
+            df, fig = cached
+    except backend.errors as e:
+        metrics.increment('analysis_errors_total', query=query_name, error=type(e).__name__)
+        st.error(f"Error while connecting to {backend.name}: {e}")
+        return
+
+    # Server side only: serializing the frame and figure for the browser
+    with metrics.timer('analysis_stage_seconds', stage='render', query=query_name):
+        st.dataframe(df)
+        st.plotly_chart(fig)
+
+##################### STORAGE BACKENDS #############################
+# STORAGE_BACKEND picks where ingested data goes and where the analysis queries run:
+# 'mysql' (default) or 'duckdb' - partitioned Parquet files queried with DuckDB, no database server needed
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mysql')
+PARQUET_DATA_DIR = os.environ.get('PARQUET_DATA_DIR', 'youtube_data')
+# Compact a partition past this many small files
+PARQUET_COMPACT_FILES = int(os.environ.get('PARQUET_COMPACT_FILES', 200))
+PARQUET_SMALL_FILE_BYTES = 8 * 1024 * 1024  # files at least this big are never rewritten by compaction
+PARQUET_COMPACT_LOCK_TIMEOUT = 3600  # seconds before a compaction lock left by a crashed writer is taken over
+PARQUET_RETIRED_FILE_TTL = 600  # seconds merged files stay on disk for queries that listed them already
+
+# Table -> (columns with DuckDB types, key) - every table is partitioned by channel_id
+PARQUET_TABLES = {
+    'channel': ({'channel_id': 'VARCHAR', 'channel_name': 'VARCHAR', 'channel_type': 'VARCHAR',
+                 'channel_views': 'BIGINT', 'channel_description': 'VARCHAR', 'channel_status': 'VARCHAR'},
+                'channel_id'),
+    'playlist': ({'playlist_id': 'VARCHAR', 'channel_id': 'VARCHAR', 'playlist_name': 'VARCHAR'},
+                 'playlist_id'),
+    'video': ({'video_id': 'VARCHAR', 'channel_id': 'VARCHAR', 'playlist_id': 'VARCHAR', 'video_name': 'VARCHAR',
+               'video_description': 'VARCHAR', 'published_date': 'TIMESTAMP', 'view_count': 'BIGINT',
+               'like_count': 'BIGINT', 'dislike_count': 'BIGINT', 'favorite_count': 'BIGINT',
+               'comment_count': 'BIGINT', 'duration': 'BIGINT', 'thumbnail': 'VARCHAR', 'caption_status': 'VARCHAR'},
+              'video_id'),
+    'Comment': ({'channel_id': 'VARCHAR', 'comment_id': 'VARCHAR', 'video_id': 'VARCHAR', 'parent_id': 'VARCHAR',
+                 'comment_text': 'VARCHAR', 'comment_author': 'VARCHAR', 'comment_published_date': 'TIMESTAMP'},
+                'comment_id'),
+    'sync_state': ({'channel_id': 'VARCHAR', 'last_published_date': 'TIMESTAMP', 'last_synced_at': 'TIMESTAMP'},
+                   'channel_id'),
+    'comment_sync': ({'channel_id': 'VARCHAR', 'video_id': 'VARCHAR', 'comments_synced_count': 'BIGINT'},
+                     'video_id'),
+    # Same columns as the MySQL rollup tables, and like them written during ingest: the rollup queries read
+    # these small tables instead of deduplicating and aggregating video and Comment on every load
+    'channel_rollup': ({'channel_id': 'VARCHAR', 'video_count': 'BIGINT', 'total_views': 'BIGINT',
+                        'avg_duration': 'DOUBLE', 'comment_count': 'BIGINT'},
+                       'channel_id'),
+    'video_comment_rollup': ({'channel_id': 'VARCHAR', 'video_id': 'VARCHAR', 'comment_count': 'BIGINT'},
+                             'video_id')
+}
+
+class StorageBackend(ABC):
+    name = None
+    errors = ()  # exceptions the pages report instead of crashing on
+    placeholder = '%s'  # query parameter marker
+
+    @abstractmethod
+    def ensure_schema(self):
+        pass
+
+    @abstractmethod
+    def write(self, channels, playlists, videos, comments, sync_state=(), comment_sync=()):
+        pass
+
+    @abstractmethod
+    def load_sync_state(self, channel_ids):
+        pass
+
+    @abstractmethod
+    def load_comment_sync_counts(self, video_ids):
+        pass
+
+    @abstractmethod
+    def query(self, sql, params=None):
+        pass
+
+    @abstractmethod
+    def iter_query(self, sql, params=None, chunk_size=MYSQL_BATCH_SIZE):
+        pass
+
+    def run_query(self, query_name):
+        return self.query(ANALYSIS_QUERIES[query_name])
+
+    @abstractmethod
+    def search(self, kind, text, channel_ids=(), start_date=None, end_date=None, limit=20, offset=0):
+        # Ranked matches: id, video_id, video_name, channel_name, published_date, text, score
+        pass
+
+
+class MySQLBackend(StorageBackend):
+    name = 'MySQL'
+    errors = (Error,)
+
+    def ensure_schema(self):
+        ensure_schema()
+
+    def write(self, channels, playlists, videos, comments, sync_state=(), comment_sync=()):
+        write_data_to_mysql(channels, playlists, videos, comments, sync_state, comment_sync)
+
+    def load_sync_state(self, channel_ids):
+        return load_sync_state(channel_ids)
+
+    def load_comment_sync_counts(self, video_ids):
+        return load_comment_sync_counts(video_ids)
+
+    def query(self, sql, params=None):
+        return run_query(sql, params)
+
+    def iter_query(self, sql, params=None, chunk_size=MYSQL_BATCH_SIZE):
+        return iter_query(sql, params, chunk_size)
+
+    def search(self, kind, text, channel_ids=(), start_date=None, end_date=None, limit=20, offset=0):
+        sql, channel_column, date_column = MYSQL_SEARCH_QUERIES[kind]
+        filters, filter_params = search_filters(channel_column, date_column, channel_ids, start_date, end_date,
+                                                self.placeholder)
+        return run_query(sql.format(filters=filters), (text, text, *filter_params, int(limit), int(offset)))
+
+
+class ParquetBackend(StorageBackend):
+    # Writes only ever append Parquet files (hive-partitioned by channel_id), so ingest workers in other
+    # processes never block readers. Upserts are resolved on read: the views keep the newest row per key.
+    name = 'DuckDB'
+    placeholder = '?'
+
+    def __init__(self, data_dir=PARQUET_DATA_DIR):
+        if duckdb is None:
+            raise RuntimeError("STORAGE_BACKEND=duckdb needs the duckdb package: pip install duckdb")
+        self.errors = (duckdb.Error, OSError)
+        self.data_dir = data_dir
+        os.makedirs(data_dir, exist_ok=True)
+        self._connection = duckdb.connect()
+        self._views_lock = threading.Lock()
+        self._file_backed = set()
+        self._empty_views = set()
+        self.ensure_schema()
+        self._backfill_rollups()
+        self._search_index = SearchIndex(os.path.join(data_dir, 'search.sqlite3'))
+        if self._search_index.is_empty() and self._file_backed & {'video', 'Comment'}:
+            self._backfill_search_index()
+
+    def table_dir(self, table):
+        return os.path.join(self.data_dir, table)
+
+    def table_files(self, table):
+        files = []
+        for root, _, names in os.walk(self.table_dir(table)):
+            files.extend(os.path.join(root, name) for name in names if name.endswith('.parquet'))
+        return files
+
+    def partition_dir(self, table, channel_id):
+        return os.path.join(self.table_dir(table), f'channel_id={channel_id}')
+
+    def small_files(self, table, channel_id):
+        files = []
+        try:
+            entries = list(os.scandir(self.partition_dir(table, channel_id)))
+        except FileNotFoundError:
+            return files
+        for entry in entries:
+            try:
+                if entry.name.endswith('.parquet') and entry.stat().st_size < PARQUET_SMALL_FILE_BYTES:
+                    files.append(entry.path)
+            except FileNotFoundError:
+                continue  # deleted by a compaction meanwhile
+        return files
+
+    def _source_sql(self, table):
+        pattern = os.path.join(self.table_dir(table), '**', '*.parquet').replace("'", "''")
+        return (f"read_parquet('{pattern}', hive_partitioning = true, hive_types = {{'channel_id': VARCHAR}}, "
+                f"union_by_name = true)")
+
+    @staticmethod
+    def _latest_rows_sql(table, select, source):
+        return f"""
+            SELECT {select}
+            FROM {source}
+            QUALIFY row_number() OVER (PARTITION BY {PARQUET_TABLES[table][1]} ORDER BY _ingested_at DESC) = 1
+        """
+
+    def _view_sql(self, table, source):
+        columns, _ = PARQUET_TABLES[table]
+        extra = ', like_count + dislike_count AS total_reactions' if table == 'video' else ''
+        return f"CREATE OR REPLACE VIEW {table} AS {self._latest_rows_sql(table, ', '.join(columns) + extra, source)}"
+
+    def _partition_rows_sql(self, table, channel_id):
+        # Newest rows of one channel's partition only, or None if the channel has no rows in the table
+        try:
+            names = os.listdir(self.partition_dir(table, channel_id))
+        except FileNotFoundError:
+            return None
+        files = [os.path.join(self.partition_dir(table, channel_id), name) for name in names
+                 if name.endswith('.parquet')]
+        if not files:
+            return None
+        file_list = ', '.join("'" + path.replace("'", "''") + "'" for path in files)
+        return self._latest_rows_sql(table, '*', f"read_parquet([{file_list}], union_by_name = true)")
+
+    def _channel_rollup(self, cursor, channel_id):
+        # Reads the channel's own partitions - once per channel ingest, like refresh_channel_rollups
+        rollup = {'channel_id': channel_id, 'video_count': 0, 'total_views': 0, 'avg_duration': 0.0,
+                  'comment_count': 0}
+        with get_metrics().timer('db_statement_seconds', backend='duckdb', statement='refresh channel_rollup'):
+            videos = self._partition_rows_sql('video', channel_id)
+            if videos is not None:
+                rollup['video_count'], rollup['total_views'], rollup['avg_duration'] = cursor.execute(
+                    f"SELECT COUNT(*), COALESCE(SUM(view_count), 0), COALESCE(AVG(duration), 0) FROM ({videos})"
+                ).fetchone()
+            comments = self._partition_rows_sql('Comment', channel_id)
+            if comments is not None:
+                rollup['comment_count'] = cursor.execute(f"SELECT COUNT(*) FROM ({comments})").fetchone()[0]
+        return rollup
+
+    def ensure_schema(self):
+        # Views are only (re)defined when a table gets its first files, not on every read and write
+        if len(self._file_backed) == len(PARQUET_TABLES):
+            return
+        with self._views_lock:
+            cursor = self._connection.cursor()
+            for table, (columns, _) in PARQUET_TABLES.items():
+                if table in self._file_backed:
+                    continue
+                if self.table_files(table):
+                    cursor.execute(self._view_sql(table, self._source_sql(table)))
+                    self._file_backed.add(table)
+                elif table not in self._empty_views:
+                    # Until the first write, the view reads an empty table of the same shape
+                    column_sql = ', '.join(f'{column} {column_type}' for column, column_type in columns.items())
+                    cursor.execute(f"CREATE TABLE IF NOT EXISTS empty_{table} ({column_sql}, _ingested_at BIGINT)")
+                    cursor.execute(self._view_sql(table, f'empty_{table}'))
+                    self._empty_views.add(table)
+            cursor.close()
+
+    def _append(self, cursor, table, frame, ingested_at):
+        if not len(frame):
+            return
+        columns, _ = PARQUET_TABLES[table]
+        select = ', '.join(f'CAST({column} AS {column_type}) AS {column}' for column, column_type in columns.items())
+        cursor.register('batch', frame)
+        try:
+            with get_metrics().timer('db_statement_seconds', backend='duckdb', statement=f'append {table}'):
+                cursor.execute(f"""
+                    COPY (SELECT {select}, {ingested_at}::BIGINT AS _ingested_at FROM batch)
+                    TO '{self.table_dir(table).replace("'", "''")}'
+                    (FORMAT parquet, PARTITION_BY (channel_id), APPEND, FILENAME_PATTERN 'part_{{uuid}}')
+                """)
+        finally:
+            cursor.unregister('batch')
+        get_metrics().increment('db_rows_written_total', len(frame), backend='duckdb', table=table)
+
+    def write(self, channels, playlists, videos, comments, sync_state=(), comment_sync=()):
+        # The pipeline stores every video before its comments, so no video lookup is needed here
+        cursor = self._connection.cursor()
+        try:
+            ingested_at = time.time_ns()
+            tables = [
+                ('channel', pd.DataFrame(list(channels), columns=list(PARQUET_TABLES['channel'][0]))),
+                ('playlist', pd.DataFrame(list(playlists), columns=list(PARQUET_TABLES['playlist'][0]))),
+                ('video', videos),
+                ('Comment', comments),
+                ('comment_sync', pd.DataFrame([{'channel_id': sync['channel_id'], 'video_id': sync['video_id'],
+                                                'comments_synced_count': sync['comment_count']}
+                                               for sync in comment_sync],
+                                              columns=list(PARQUET_TABLES['comment_sync'][0]))),
+                # The pipeline counts the comments it stored for each synced video
+                ('video_comment_rollup', pd.DataFrame([{'channel_id': sync['channel_id'], 'video_id': sync['video_id'],
+                                                        'comment_count': sync['stored_comment_count']}
+                                                       for sync in comment_sync],
+                                                      columns=list(PARQUET_TABLES['video_comment_rollup'][0])))
+            ]
+            for table, frame in tables:
+                self._append(cursor, table, frame, ingested_at)
+            # A channel's rollup once its last chunk is on disk, and last of all its watermark
+            for table, frame in [
+                ('channel_rollup', pd.DataFrame([self._channel_rollup(cursor, state['channel_id'])
+                                                 for state in sync_state],
+                                                columns=list(PARQUET_TABLES['channel_rollup'][0]))),
+                ('sync_state', pd.DataFrame(list(sync_state), columns=list(PARQUET_TABLES['sync_state'][0])))
+            ]:
+                self._append(cursor, table, frame, ingested_at)
+                tables.append((table, frame))
+            with get_metrics().timer('db_statement_seconds', backend='sqlite', statement='index search'):
+                self._search_index.add('video', search_documents('video', videos))
+                self._search_index.add('comment', search_documents('comment', comments))
+            for table, frame in tables:
+                for channel_id in (frame['channel_id'].unique() if len(frame) else ()):
+                    if len(self.small_files(table, channel_id)) > PARQUET_COMPACT_FILES:
+                        self.compact(table, channel_id)
+        finally:
+            cursor.close()
+            get_data_generation().bump()
+        self.ensure_schema()
+
+    def compact(self, table, channel_id):
+        # Every chunk adds small files. The small files of one partition are merged into one file holding
+        # the newest row per key; files past PARQUET_SMALL_FILE_BYTES are left alone, so each row is only
+        # rewritten a bounded number of times. Merged files stay on disk for PARQUET_RETIRED_FILE_TTL, as
+        # running queries may have listed them already - until then the views drop their rows as duplicates.
+        lock_path = os.path.join(self.data_dir, f'.{table}.compact.lock')
+        try:
+            if time.time() - os.path.getmtime(lock_path) > PARQUET_COMPACT_LOCK_TIMEOUT:
+                os.remove(lock_path)
+        except FileNotFoundError:
+            pass
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return  # another writer is compacting this table
+
+        try:
+            retired = self._purge_retired_files(table)
+            files = [path for path in self.small_files(table, channel_id) if path not in retired]
+            if len(files) <= PARQUET_COMPACT_FILES:
+                return  # only retired files pushed the partition over the limit
+            columns, key = PARQUET_TABLES[table]
+            # channel_id comes from the directory name, like in the files DuckDB writes
+            select = ', '.join(column for column in columns if column != 'channel_id')
+            file_list = ', '.join("'" + path.replace("'", "''") + "'" for path in files)
+            output_path = os.path.join(self.partition_dir(table, channel_id), f'compact_{uuid.uuid4().hex}.parquet')
+            cursor = self._connection.cursor()
+            try:
+                with get_metrics().timer('db_statement_seconds', backend='duckdb', statement=f'compact {table}'):
+                    # Written under a name the views do not match, then renamed into place in one step
+                    cursor.execute(f"""
+                        COPY (
+                            SELECT {select}, _ingested_at
+                            FROM read_parquet([{file_list}], union_by_name = true)
+                            QUALIFY row_number() OVER (PARTITION BY {key} ORDER BY _ingested_at DESC) = 1
+                        )
+                        TO '{(output_path + '.tmp').replace("'", "''")}' (FORMAT parquet)
+                    """)
+            finally:
+                cursor.close()
+            os.replace(output_path + '.tmp', output_path)
+            retired.update(dict.fromkeys(files, time.time()))
+            self._save_retired_files(table, retired)
+        finally:
+            os.remove(lock_path)
+
+    def _retired_files_path(self, table):
+        return os.path.join(self.data_dir, f'.{table}.retired.json')
+
+    def _save_retired_files(self, table, retired):
+        temp_path = self._retired_files_path(table) + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as retired_file:
+            json.dump(retired, retired_file)
+        os.replace(temp_path, self._retired_files_path(table))
+
+    def _purge_retired_files(self, table):
+        # Path -> time it was merged; deletes the files past their TTL and returns the others
+        try:
+            with open(self._retired_files_path(table), encoding='utf-8') as retired_file:
+                retired = json.load(retired_file)
+        except FileNotFoundError:
+            return {}
+        expired = [path for path, retired_at in retired.items()
+                   if time.time() - retired_at > PARQUET_RETIRED_FILE_TTL]
+        for path in expired:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            del retired[path]
+        if expired:
+            self._save_retired_files(table, retired)
+        return retired
+
+    def _backfill_rollups(self):
+        # Data written before the rollup tables existed
+        cursor = self._connection.cursor()
+        try:
+            ingested_at = time.time_ns()
+            if 'channel' in self._file_backed and 'channel_rollup' not in self._file_backed:
+                channel_ids = [row[0] for row in cursor.execute('SELECT channel_id FROM channel').fetchall()]
+                self._append(cursor, 'channel_rollup', pd.DataFrame(
+                    [self._channel_rollup(cursor, channel_id) for channel_id in channel_ids],
+                    columns=list(PARQUET_TABLES['channel_rollup'][0])), ingested_at)
+            if 'comment_sync' in self._file_backed and 'video_comment_rollup' not in self._file_backed:
+                self._append(cursor, 'video_comment_rollup', cursor.execute('''
+                    SELECT comment_sync.channel_id, comment_sync.video_id, COUNT(Comment.comment_id) AS comment_count
+                    FROM comment_sync
+                    LEFT JOIN Comment ON Comment.video_id = comment_sync.video_id
+                    GROUP BY comment_sync.channel_id, comment_sync.video_id
+                ''').df(), ingested_at)
+        finally:
+            cursor.close()
+        self.ensure_schema()
+
+    def _backfill_search_index(self):
+        # Data written before the search index existed
+        for kind, table, date_column in (('video', 'video', 'published_date'),
+                                         ('comment', 'Comment', 'comment_published_date')):
+            sql = f"SELECT * REPLACE (strftime({date_column}, '%Y-%m-%d %H:%M:%S') AS {date_column}) FROM {table}"
+            for chunk in self.iter_query(sql):
+                self._search_index.add(kind, search_documents(kind, chunk))
+
+    def search(self, kind, text, channel_ids=(), start_date=None, end_date=None, limit=20, offset=0):
+        results = self._search_index.search(kind, text, channel_ids, start_date, end_date, limit, offset)
+        # Names come from the current rows, so renamed videos and channels show their new name
+        names = self.query('''
+            SELECT video.video_id, video_name, channel_name
+            FROM video
+            JOIN channel ON channel.channel_id = video.channel_id
+            WHERE list_contains(?, video.video_id)
+        ''', [results['video_id'].unique().tolist()])
+        results = results.merge(names, on='video_id', how='left')
+        return results[['id', 'video_id', 'video_name', 'channel_name', 'published_date', 'text', 'score']]
+
+    def _fetch_lookup(self, sql, values, statement):
+        self.ensure_schema()
+        cursor = self._connection.cursor()
+        try:
+            with get_metrics().timer('db_statement_seconds', backend='duckdb', statement=statement):
+                return dict(cursor.execute(sql, [list(values)]).fetchall())
+        finally:
+            cursor.close()
+
+    def load_sync_state(self, channel_ids):
+        return self._fetch_lookup('SELECT channel_id, last_published_date FROM sync_state '
+                                  'WHERE list_contains(?, channel_id)', channel_ids, 'select sync_state')
+
+    def load_comment_sync_counts(self, video_ids):
+        return self._fetch_lookup('SELECT video_id, comments_synced_count FROM comment_sync '
+                                  'WHERE list_contains(?, video_id)', video_ids, 'select comments_synced_count')
+
+    # The MySQL analysis queries run unchanged against the views
+    def query(self, sql, params=None):
+        self.ensure_schema()
+        cursor = self._connection.cursor()
+        try:
+            with get_metrics().timer('db_statement_seconds', backend='duckdb', statement='query'):
+                return cursor.execute(sql, params).df()
+        finally:
+            cursor.close()
+
+    def iter_query(self, sql, params=None, chunk_size=MYSQL_BATCH_SIZE):
+        self.ensure_schema()
+        cursor = self._connection.cursor()
+        try:
+            with get_metrics().timer('db_statement_seconds', backend='duckdb', statement='streamed query'):
+                cursor.execute(sql, params)
+            columns = [i[0] for i in cursor.description]
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield pd.DataFrame(rows, columns=columns)
+        finally:
+            cursor.close()
+
+
+STORAGE_BACKENDS = {'mysql': MySQLBackend, 'duckdb': ParquetBackend}
+
+
+@st.cache_resource(show_spinner=False)
+def get_storage_backend(name=STORAGE_BACKEND):
+    if name not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown STORAGE_BACKEND {name!r}; expected one of {', '.join(STORAGE_BACKENDS)}")
+    return STORAGE_BACKENDS[name]()
+
+
+##################### FULL-TEXT SEARCH #############################
+# Search page scope -> kind of document searched
+SEARCH_SCOPES = {"Comments": 'comment', "Video titles and descriptions": 'video'}
+SEARCH_PAGE_SIZES = [10, 20, 50]
+SEARCH_EXCERPT_CHARS = 300
+
+# MySQL: natural-language MATCH ... AGAINST over the FULLTEXT indexes of migration 4, ranked by relevance.
+# Kind -> (query taking {filters}, channel column, published date column)
+MYSQL_SEARCH_QUERIES = {
+    'comment': ('''
+        SELECT Comment.comment_id AS id, video.video_id, video_name, channel_name,
+               comment_published_date AS published_date, comment_text AS text,
+               MATCH (comment_text) AGAINST (%s IN NATURAL LANGUAGE MODE) AS score
+        FROM Comment
+        JOIN video ON video.video_id = Comment.video_id
+        JOIN channel ON channel.channel_id = Comment.channel_id
+        WHERE MATCH (comment_text) AGAINST (%s IN NATURAL LANGUAGE MODE){filters}
+        ORDER BY score DESC
+        LIMIT %s OFFSET %s
+    ''', 'Comment.channel_id', 'comment_published_date'),
+    'video': ('''
+        SELECT video.video_id AS id, video.video_id, video_name, channel_name, published_date,
+               video_description AS text,
+               MATCH (video_name, video_description) AGAINST (%s IN NATURAL LANGUAGE MODE) AS score
+        FROM video
+        JOIN channel ON channel.channel_id = video.channel_id
+        WHERE MATCH (video_name, video_description) AGAINST (%s IN NATURAL LANGUAGE MODE){filters}
+        ORDER BY score DESC
+        LIMIT %s OFFSET %s
+    ''', 'video.channel_id', 'published_date')
+}
+
+# Embedded backend: an SQLite FTS5 inverted index next to the Parquet files, one per kind of document,
+# updated with every write. search_docs maps each document to its FTS row and holds the filter columns.
+SEARCH_INDEX_SCHEMA = [
+    '''
+        CREATE TABLE IF NOT EXISTS search_docs (
+            doc_id INTEGER PRIMARY KEY,
+            kind TEXT,
+            key TEXT,
+            channel_id TEXT,
+            video_id TEXT,
+            published_date TEXT,
+            UNIQUE (kind, key)
         )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_search_docs_filters ON search_docs (kind, channel_id, published_date)',
+    *(f'CREATE VIRTUAL TABLE IF NOT EXISTS search_{kind} USING fts5(body)' for kind in SEARCH_SCOPES.values())
+]
+
+
+def search_filters(channel_column, date_column, channel_ids, start_date, end_date, placeholder):
+    clauses, params = [], []
+    if channel_ids:
+        clauses.append(f"{channel_column} IN ({', '.join([placeholder] * len(channel_ids))})")
+        params.extend(channel_ids)
+    if start_date is not None:
+        clauses.append(f'{date_column} >= {placeholder}')
+        params.append(f'{start_date:%Y-%m-%d} 00:00:00')
+    if end_date is not None:
+        # The end date is inclusive
+        clauses.append(f'{date_column} < {placeholder}')
+        params.append(f'{end_date + timedelta(days=1):%Y-%m-%d} 00:00:00')
+    return ''.join(f' AND {clause}' for clause in clauses), params
+
+
+def search_documents(kind, frame):
+    # (key, channel_id, video_id, published date, body) rows for the search index from normalized frames
+    if kind == 'video':
+        documents = frame.assign(key=frame['video_id'], published=frame['published_date'],
+                                 body=frame['video_name'].fillna('') + '\n' + frame['video_description'].fillna(''))
+    else:
+        documents = frame.assign(key=frame['comment_id'], published=frame['comment_published_date'],
+                                 body=frame['comment_text'].fillna(''))
+    return frame_rows(documents, ['key', 'channel_id', 'video_id', 'published', 'body'])
+
+
+class SearchIndex:
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        # Ingest workers in other processes write the same file - wait for their transactions
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        for statement in SEARCH_INDEX_SCHEMA:
+            self._connection.execute(statement)
+
+    def is_empty(self):
+        with self._lock:
+            return self._connection.execute('SELECT NOT EXISTS (SELECT 1 FROM search_docs)').fetchone()[0]
+
+    def add(self, kind, documents):
+        # Upsert: a re-ingested document replaces its earlier text
+        if not documents:
+            return
+        keys = [(kind, document[0]) for document in documents]
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                self._connection.executemany('''
+                    INSERT INTO search_docs (kind, key, channel_id, video_id, published_date)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (kind, key) DO UPDATE SET
+                        channel_id = excluded.channel_id,
+                        video_id = excluded.video_id,
+                        published_date = excluded.published_date
+                ''', [(kind, *document[:4]) for document in documents])
+                self._connection.executemany(f'''
+                    DELETE FROM search_{kind}
+                    WHERE rowid = (SELECT doc_id FROM search_docs WHERE kind = ? AND key = ?)
+                ''', keys)
+                self._connection.executemany(f'''
+                    INSERT INTO search_{kind} (rowid, body)
+                    SELECT doc_id, ? FROM search_docs WHERE kind = ? AND key = ?
+                ''', [(document[4], kind, document[0]) for document in documents])
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+
+    def search(self, kind, text, channel_ids=(), start_date=None, end_date=None, limit=20, offset=0):
+        # Every word quoted, so user input is never parsed as FTS5 query syntax; any word may match,
+        # like MySQL's natural-language mode, and bm25 ranks documents matching more of them first
+        match = ' OR '.join('"' + word.replace('"', '""') + '"' for word in text.split())
+        filters, filter_params = search_filters('search_docs.channel_id', 'search_docs.published_date', channel_ids,
+                                                start_date, end_date, '?')
+        with self._lock:
+            cursor = self._connection.execute(f'''
+                SELECT search_docs.key AS id, search_docs.video_id, search_docs.channel_id,
+                       search_docs.published_date, snippet(search_{kind}, 0, '«', '»', '…', 48) AS text,
+                       -bm25(search_{kind}) AS score
+                FROM search_{kind}
+                JOIN search_docs ON search_docs.doc_id = search_{kind}.rowid
+                WHERE search_{kind} MATCH ? AND search_docs.kind = ?{filters}
+                ORDER BY bm25(search_{kind})
+                LIMIT ? OFFSET ?
+            ''', (match, kind, *filter_params, int(limit), int(offset)))
+            return pd.DataFrame(cursor.fetchall(), columns=[i[0] for i in cursor.description])
+
+
+def show_search_page():
+    st.header("Search")
+    backend = get_storage_backend()
+    text = st.text_input("Search for")
+    scope = st.radio("Search in", list(SEARCH_SCOPES), horizontal=True)
+    try:
+        channels = backend.query('SELECT channel_id, channel_name FROM channel ORDER BY channel_name')
+    except backend.errors as e:
+        st.error(f"Error while connecting to {backend.name}: {e}")
+        return
+    channel_names = dict(zip(channels['channel_id'], channels['channel_name']))
+    channel_ids = st.multiselect("Channels", list(channel_names), format_func=channel_names.get)
+    from_column, until_column, size_column = st.columns(3)
+    start_date = from_column.date_input("Published from", value=None)
+    end_date = until_column.date_input("Published until", value=None)
+    page_size = size_column.selectbox("Results per page", SEARCH_PAGE_SIZES, index=1)
+    if not text.strip():
+        return
+
+    # Back to the first page whenever the search changes
+    search_key = (text, scope, tuple(channel_ids), start_date, end_date, page_size)
+    if st.session_state.get('search-key') != search_key:
+        st.session_state['search-key'] = search_key
+        st.session_state['search-page'] = 0
+    page = st.session_state['search-page']
+
+    kind = SEARCH_SCOPES[scope]
+    try:
+        with get_metrics().timer('search_seconds', backend=backend.name.lower(), kind=kind):
+            # One extra row tells whether there is a next page
+            results = backend.search(kind, text, channel_ids, start_date, end_date, page_size + 1, page * page_size)
+    except backend.errors as e:
+        get_metrics().increment('search_errors_total', backend=backend.name.lower(), error=type(e).__name__)
+        st.error(f"Error while connecting to {backend.name}: {e}")
+        return
+
+    has_next_page = len(results) > page_size
+    results = results.head(page_size)
+    results['text'] = results['text'].str.slice(0, SEARCH_EXCERPT_CHARS)
+    st.dataframe(results)
+
+    previous_column, page_column, next_column = st.columns(3)
+    if previous_column.button("Previous page", disabled=page == 0):
+        st.session_state['search-page'] -= 1
+        st.rerun()
+    page_column.write(f"Page {page + 1}")
+    if next_column.button("Next page", disabled=not has_next_page):
+        st.session_state['search-page'] += 1
+        st.rerun()
+
+
+##################### BACKGROUND INGEST JOBS #############################
+# Ingest runs in a worker process (ingest_job.py); the page only starts jobs and polls their status.
+# Job state is a JSON file per job, so a crashed job can be resumed from the channels it had not finished.
+INGEST_JOB_DIR = os.environ.get('INGEST_JOB_DIR', '.ingest_jobs')
+INGEST_JOB_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ingest_job.py')
+JOB_HEARTBEAT_SECONDS = 10
+JOB_HEARTBEAT_TIMEOUT = 60  # a running job without a heartbeat for this long is treated as crashed
+JOB_WARNINGS_KEPT = 50
+
+
+class JobLockedError(Exception):
+    pass
+
+
+def utc_now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def channel_set_key(channel_ids):
+    return hashlib.sha1(','.join(sorted(set(channel_ids))).encode()).hexdigest()[:16]
+
+
+def api_key_fingerprint(api_key):
+    # Enough to sum quota use per key without writing the key itself to disk
+    return hashlib.sha256(api_key.encode()).hexdigest()[:12]
+
+
+def job_path(job_id):
+    return os.path.join(INGEST_JOB_DIR, f"{job_id}.json")
+
+
+def load_job(job_id):
+    with open(job_path(job_id), encoding='utf-8') as job_file:
+        return json.load(job_file)
+
+
+def save_job(job):
+    os.makedirs(INGEST_JOB_DIR, exist_ok=True)
+    # Write-then-rename so pollers never read a half-written file
+    temp_path = job_path(job['job_id']) + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as job_file:
+        json.dump(job, job_file, default=str)
+    os.replace(temp_path, job_path(job['job_id']))
 
-        if connection.is_connected():
-            cursor = connection.cursor()
-
-            queries = {
-                "Video Names and Corresponding Channels": '''
-                    SELECT video_name, channel_name
-                    FROM video
-                    JOIN channel ON video.channel_id = channel.channel_id
-                ''',
-                "Channels with Most Videos": '''
-                    SELECT channel_name, COUNT(*) AS video_count
-                    FROM video
-                    JOIN channel ON video.channel_id = channel.channel_id
-                    GROUP BY channel_name
-                    ORDER BY video_count DESC
-                ''',
-                "Top 10 Most Viewed Videos": '''
-                    SELECT video_name, view_count
-                    FROM video
-                    ORDER BY view_count DESC
-                    LIMIT 10
-                ''',
-                "Comments on Each Video": '''
-                    SELECT video_name, COUNT(*) AS comment_count
-                    FROM video
-                    JOIN Comment ON video.video_id = Comment.video_id
-                    GROUP BY video_name
-                    ORDER BY comment_count DESC
-                ''',
-                "Videos with Highest Likes": '''
-                    SELECT video_name, like_count
-                    FROM video
-                    ORDER BY like_count DESC
-                    LIMIT 10
-                ''',
-                "Total Likes and Dislikes for Each Video": '''
-                    SELECT video_name, like_count, dislike_count
-                    FROM video
-                    ORDER BY (like_count + dislike_count) DESC
-                ''',
-                "Total Views for Each Channel": '''
-                    SELECT channel_name, SUM(view_count) AS total_views
-                    FROM video
-                    JOIN channel ON video.channel_id = channel.channel_id
-                    GROUP BY channel_name
-                    ORDER BY total_views DESC
-                ''',
-                "Channels with Videos Published in 2024": '''
-                    SELECT channel_name, COUNT(*) AS video_count
-                    FROM video
-                    JOIN channel ON video.channel_id = channel.channel_id
-                    WHERE YEAR(published_date) = 2024
-                    GROUP BY channel_name
-                ''',
-                "Average Duration of Videos in Each Channel": '''
-                    SELECT channel_name, AVG(duration) AS avg_duration
-                    FROM video
-                    JOIN channel ON video.channel_id = channel.channel_id
-                    GROUP BY channel_name
-                    ORDER BY avg_duration DESC
-                ''',
-                "Videos with Highest Number of Comments": '''
-                    SELECT video_name, comment_count
-                    FROM video
-                    ORDER BY comment_count DESC
-                    LIMIT 10
-                '''
-            }
 
-            st.header("Query Results")
-
-            for query_name, query in queries.items():
-                if st.button(query_name):
-                    cursor.execute(query)
-                    result = cursor.fetchall()
-                    df = pd.DataFrame(result, columns=[i[0] for i in cursor.description])
-                    st.dataframe(df)
-
-                    # Generate graphs using Plotly
-                    if query_name == "Video Names and Corresponding Channels":
-                        fig = px.bar(df, x='video_name', y='channel_name',
-                                     title="Video Names and Corresponding Channels")
-                    elif query_name == "Channels with Most Videos":
-                        fig = px.bar(df, x='channel_name', y='video_count', title="Channels with Most Videos")
-                    elif query_name == "Top 10 Most Viewed Videos":
-                        fig = px.bar(df, x='video_name', y='view_count', title="Top 10 Most Viewed Videos")
-                    elif query_name == "Comments on Each Video":
-                        fig = px.bar(df, x='video_name', y='comment_count', title="Comments on Each Video")
-                    elif query_name == "Videos with Highest Likes":
-                        fig = px.bar(df, x='video_name', y='like_count', title="Videos with Highest Likes")
-                    elif query_name == "Total Likes and Dislikes for Each Video":
-                        fig = px.bar(df, x='video_name', y=['like_count', 'dislike_count'],
-                                     title="Total Likes and Dislikes for Each Video", barmode='group')
-                    elif query_name == "Total Views for Each Channel":
-                        fig = px.bar(df, x='channel_name', y='total_views', title="Total Views for Each Channel")
-                    elif query_name == "Channels with Videos Published in 2024":
-                        fig = px.bar(df, x='channel_name', y='video_count',
-                                     title="Channels with Videos Published in 2024")
-                    elif query_name == "Average Duration of Videos in Each Channel":
-                        fig = px.bar(df, x='channel_name', y='avg_duration',
-                                     title="Average Duration of Videos in Each Channel")
-                    elif query_name == "Videos with Highest Number of Comments":
-                        fig = px.bar(df, x='video_name', y='comment_count',
-                                     title="Videos with Highest Number of Comments")
-
-                    st.plotly_chart(fig)
-
-    except Error as e:
-        st.error(f"Error while connecting to MySQL: {e}")
+def list_jobs(limit=10):
+    if not os.path.isdir(INGEST_JOB_DIR):
+        return []
+    jobs = []
+    for name in os.listdir(INGEST_JOB_DIR):
+        if name.endswith('.json'):
+            try:
+                jobs.append(load_job(name[:-len('.json')]))
+            except (OSError, ValueError):
+                continue  # being replaced right now
+    jobs.sort(key=lambda job: job['created_at'], reverse=True)
+    return jobs[:limit]
+
+
+def ingest_data_marker_path():
+    return os.path.join(INGEST_JOB_DIR, 'data-written')
+
+
+def touch_ingest_data_marker():
+    os.makedirs(INGEST_JOB_DIR, exist_ok=True)
+    with open(ingest_data_marker_path(), 'a', encoding='utf-8'):
+        pass
+    os.utime(ingest_data_marker_path())
+
+
+def ingest_jobs_marker():
+    # Changes whenever a job has written a chunk - used to invalidate cached analysis results. Not the job
+    # files: the heartbeat rewrites those every few seconds without any new data.
+    try:
+        return os.stat(ingest_data_marker_path()).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def job_status(job):
+    # A worker that died (or never started) stops updating its heartbeat
+    if job['status'] in ('queued', 'running'):
+        last_seen = datetime.fromisoformat(job['heartbeat_at'] or job['created_at'])
+        if (utc_now() - last_seen).total_seconds() > JOB_HEARTBEAT_TIMEOUT:
+            return 'interrupted'
+    return job['status']
+
+
+def create_job(api_key, channel_ids, workers, incremental, recency_days):
+    job = {
+        'job_id': f"{utc_now():%Y%m%d%H%M%S}-{channel_set_key(channel_ids)[:8]}-{random.randrange(16 ** 4):04x}",
+        'channel_set': channel_set_key(channel_ids),
+        'channel_ids': list(channel_ids),
+        'workers': int(workers),
+        'incremental': bool(incremental),
+        'recency_days': int(recency_days),
+        'api_key_fingerprint': api_key_fingerprint(api_key),
+        'status': 'queued',
+        'created_at': utc_now().isoformat(),
+        'started_at': None,
+        'heartbeat_at': None,
+        'finished_at': None,
+        'completed_channel_ids': [],
+        'stored_videos': 0,
+        'stored_comments': 0,
+        'quota_day': None,
+        'quota_units_used': 0,
+        'warnings': [],
+        'error': None,
+        'metrics': None
+    }
+    save_job(job)
+    return job
+
 
+def acquire_channel_set_lock(channel_ids, job_id):
+    # An OS file lock, which the OS drops when the worker exits, crashed or not - so there is never a stale
+    # lock to take over. The file only names the holder for the error message and is never deleted.
+    os.makedirs(INGEST_JOB_DIR, exist_ok=True)
+    lock_file = open(os.path.join(INGEST_JOB_DIR, f"{channel_set_key(channel_ids)}.lock"), 'a+', encoding='utf-8')
+    lock_file.seek(0)  # msvcrt locks bytes from the current position; every worker locks the first one
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        try:
+            holder = lock_file.read().strip()
+        except OSError:
+            holder = ''  # Windows does not let other processes read a locked byte
+        lock_file.close()
+        raise JobLockedError(f"Job {holder or 'another job'} is already ingesting this channel set")
+    lock_file.truncate(0)
+    lock_file.write(job_id)
+    lock_file.flush()
+    return lock_file
+
+
+def release_channel_set_lock(lock_file):
+    if fcntl is None:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+    lock_file.close()  # drops the flock
+
+
+def run_ingest_job(job_id, api_key):
+    job = load_job(job_id)
+    try:
+        lock_file = acquire_channel_set_lock(job['channel_ids'], job_id)
+    except JobLockedError as e:
+        if job['status'] == 'queued':
+            job.update(status='failed', error=str(e), finished_at=utc_now().isoformat())
+            save_job(job)
+        raise
+
+    limiter = get_quota_limiter(api_key)
+    quota_day = datetime.now(QUOTA_RESET_TIMEZONE).date().isoformat()
+    if job['quota_day'] != quota_day:
+        job['quota_day'] = quota_day
+        job['quota_units_used'] = 0
+    quota_before_run = job['quota_units_used']
+    quota_start = limiter.used_today
+
+    job_lock = threading.Lock()
+    stop_heartbeat = threading.Event()
+    metrics = get_metrics()
+
+    def save():
+        with job_lock:
+            job['quota_units_used'] = quota_before_run + limiter.used_today - quota_start
+            # Metrics of the worker process, for the Diagnostics page of the app
+            job['metrics'] = metrics.snapshot()
+            job['heartbeat_at'] = utc_now().isoformat()
+            save_job(job)
+
+    def heartbeat():
+        while not stop_heartbeat.wait(JOB_HEARTBEAT_SECONDS):
+            save()
+
+    job.update(status='running', started_at=utc_now().isoformat(), finished_at=None, error=None)
+    save()
+    heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+    heartbeat_thread.start()
+
+    try:
+        backend = get_storage_backend()
+        remaining = [channel_id for channel_id in job['channel_ids']
+                     if channel_id not in job['completed_channel_ids']]
+        chunks = ()
+        if remaining:
+            with metrics.timer('ingest_stage_seconds', stage='load_sync_state'):
+                watermarks = backend.load_sync_state(remaining) if job['incremental'] else {}
+            chunks = iter_ingest_chunks(api_key, remaining, workers=job['workers'], watermarks=watermarks,
+                                        recency_window=timedelta(days=job['recency_days']),
+                                        comment_sync_lookup=backend.load_comment_sync_counts)
+
+        for chunk in chunks:
+            with metrics.timer('ingest_stage_seconds', stage='store'):
+                try:
+                    backend.write(chunk['channels'], chunk['playlists'], chunk['videos'], chunk['comments'],
+                                  chunk['sync_state'], chunk['comment_sync'])
+                finally:
+                    # Even a failed write may have committed some batches
+                    touch_ingest_data_marker()
+            with job_lock:
+                job['stored_videos'] += len(chunk['videos'])
+                job['stored_comments'] += len(chunk['comments'])
+                if chunk['missing_video_ids']:
+                    job['warnings'].append(f"Videos not returned by the API: {', '.join(chunk['missing_video_ids'])}")
+                job['warnings'].extend(f"Comments are disabled for video: {video_id}"
+                                       for video_id in chunk['comments_disabled_video_ids'])
+                del job['warnings'][:-JOB_WARNINGS_KEPT]
+                # The sync_state row is the channel's last chunk - a resumed job skips the channel
+                job['completed_channel_ids'].extend(state['channel_id'] for state in chunk['sync_state'])
+            if chunk['sync_state']:
+                save()
+
+        job['status'] = 'succeeded'
+    except Exception as e:
+        job['status'] = 'failed'
+        job['error'] = f"{type(e).__name__}: {e}"
+        metrics.increment('ingest_errors_total', error=type(e).__name__)
+        raise
     finally:
-        if connection and connection.is_connected():
-            cursor.close()
-            connection.close()
+        stop_heartbeat.set()
+        heartbeat_thread.join()
+        job['finished_at'] = utc_now().isoformat()
+        save()
+        release_channel_set_lock(lock_file)
+    return job
 
-############### MAIN FUNCTION ######################
+
+def start_ingest_job(api_key, channel_ids, workers, incremental, recency_days):
+    for job in list_jobs(limit=None):
+        if job['channel_set'] == channel_set_key(channel_ids) and job_status(job) in ('queued', 'running'):
+            raise JobLockedError(f"Job {job['job_id']} is already ingesting this channel set")
+    job = create_job(api_key, channel_ids, workers, incremental, recency_days)
+    launch_ingest_worker(job['job_id'], api_key)
+    return job
+
+
+def launch_ingest_worker(job_id, api_key):
+    # Detached from the Streamlit session: reruns, disconnects and server restarts do not stop the job.
+    # The API key travels in the environment rather than argv, where other users could read it.
+    subprocess.Popen([sys.executable, INGEST_JOB_SCRIPT, 'run', job_id],
+                     env={**os.environ, 'YOUTUBE_API_KEY': api_key},
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+
+
+def show_ingest_jobs(api_key):
+    st.subheader("Ingest Jobs")
+    st.button("Refresh Status")
+
+    for job in list_jobs():
+        status = job_status(job)
+        completed = len(job['completed_channel_ids'])
+        total = len(job['channel_ids'])
+        st.write(f"**{job['job_id']}** - {status} - {completed}/{total} channels, {job['stored_videos']} videos, "
+                 f"{job['stored_comments']} comments, {job['quota_units_used']} quota units")
+        st.progress(completed / total if total else 1.0)
+        if job['error']:
+            st.error(job['error'])
+        if job['warnings']:
+            with st.expander(f"Warnings ({len(job['warnings'])})"):
+                for warning in job['warnings']:
+                    st.write(warning)
+        if status in ('failed', 'interrupted') and st.button("Resume", key=f"resume-{job['job_id']}"):
+            # The list was read before the click - another session or the CLI may have resumed the job since
+            if job_status(load_job(job['job_id'])) not in ('failed', 'interrupted'):
+                st.warning(f"Ingest job {job['job_id']} is already running")
+            elif api_key:
+                launch_ingest_worker(job['job_id'], api_key)
+                st.success(f"Resumed ingest job {job['job_id']}")
+            else:
+                st.error("Please enter the YouTube Data API key to resume the job.")
+
+
+##################### DIAGNOSTICS #############################
+def metric_labels_text(labels):
+    return ', '.join(f'{label}={value}' for label, value in labels.items())
 
 
-st.title("YouTube Channel Data Analysis Application")
+def summarize_histograms(snapshot):
+    # Percentiles are bucket upper bounds, so read p95_ms = 250 as "95% of calls took at most 250 ms"
+    rows = []
+    for histogram in snapshot['histograms']:
+        count = histogram['count']
+        row = {'metric': histogram['name'], 'labels': metric_labels_text(histogram['labels']), 'count': count,
+               'total_s': round(histogram['sum'], 3), 'mean_ms': round(histogram['sum'] / count * 1000, 2)}
+        for quantile in (0.5, 0.95, 0.99):
+            row[f'p{int(quantile * 100)}_ms'] = histogram_quantile(snapshot['buckets'], histogram['buckets'],
+                                                                   quantile) * 1000
+        rows.append(row)
+    return pd.DataFrame(rows)
 
 
+def cache_hit_rates(snapshot):
+    # Cache name -> (hits, lookups); a revalidated API response is served from the cache too
+    totals = {'API responses': [0, 0], 'Analysis results': [0, 0]}
+    for counter in snapshot['counters']:
+        if counter['name'] == 'youtube_response_cache_total':
+            cache = totals['API responses']
+            cache[0] += counter['value'] if counter['labels']['result'] != 'miss' else 0
+        elif counter['name'] == 'query_cache_requests_total':
+            cache = totals['Analysis results']
+            cache[0] += counter['value'] if counter['labels']['result'] == 'hit' else 0
+        else:
+            continue
+        cache[1] += counter['value']
+    return totals
+
+
+def show_diagnostics():
+    st.header("Diagnostics")
+    # The app server's own metrics, and those of ingest worker processes as saved with their jobs
+    sources = {"This app server": get_metrics().snapshot()}
+    for job in list_jobs():
+        if job.get('metrics'):
+            sources[f"Ingest job {job['job_id']} ({job_status(job)})"] = job['metrics']
+    source = st.selectbox("Metrics of", list(sources))
+    snapshot = sources[source]
+    st.caption(f"Collected since {snapshot['started_at']} UTC")
+
+    for column, (cache_name, (hits, lookups)) in zip(st.columns(2), cache_hit_rates(snapshot).items()):
+        column.metric(f"{cache_name} cache hit rate", f"{hits / lookups:.0%}" if lookups else "n/a",
+                      help=f"{hits} of {lookups} lookups")
+
+    st.subheader("Latency")
+    st.dataframe(summarize_histograms(snapshot))
+    st.subheader("Counters")
+    st.dataframe(pd.DataFrame([{'metric': counter['name'], 'labels': metric_labels_text(counter['labels']),
+                                'value': counter['value']} for counter in snapshot['counters']]))
+
+    json_column, prometheus_column, reset_column = st.columns(3)
+    json_column.download_button("Export JSON", data=json.dumps(snapshot, indent=2), file_name='metrics.json',
+                                mime='application/json')
+    prometheus_column.download_button("Export Prometheus text", data=metrics_to_prometheus(snapshot),
+                                      file_name='metrics.prom', mime='text/plain')
+    if source == "This app server" and reset_column.button("Reset metrics"):
+        get_metrics().reset()
+        st.rerun()
+
+
+############### MAIN FUNCTION ######################
 def main():
+    st.title("YouTube Channel Data Analysis Application")
+
     # Sidebar navigation
     st.sidebar.title('Navigation')
-    app_mode = st.sidebar.selectbox("Choose the app mode", ["Home", "Fetch and Store", "Analysis"])
+    app_mode = st.sidebar.selectbox("Choose the app mode", ["Home", "Fetch and Store", "Analysis",
+                                                             "Search", "Diagnostics"])
 
     if app_mode == 'Home':
         st.header("Welcome to the YouTube Channel Data Analysis App!")
@@ -380,88 +2696,36 @@ def main():
         st.header("Fetch and Store Data")
         api_key = st.text_input("Enter YouTube Data API v3 Key", type="password")
         channel_ids_input = st.text_input("Enter YouTube Channel IDs (comma-separated)")
+        workers = st.number_input("Concurrent fetch workers", min_value=1, max_value=32, value=DEFAULT_FETCH_WORKERS)
+        incremental = st.checkbox("Incremental sync (only new videos and recent statistics)", value=True)
+        recency_days = st.number_input("Refresh statistics for videos published in the last N days", min_value=0,
+                                       value=DEFAULT_RECENCY_WINDOW_DAYS, disabled=not incremental)
 
         if st.button("Fetch and Store Data"):
             if api_key and channel_ids_input:
                 channel_ids = [channel_id.strip() for channel_id in channel_ids_input.split(',')]
-                channels = []
-                playlists = []
-                videos = []
-                comments = []
-
-                channel_details = get_channel_details(api_key, channel_ids)
-                for channel in channel_details['items']:
-                    channel_id = channel['id']
-                    channel_name = channel['snippet']['title']
-                    channel_type = channel['snippet'].get('type', 'N/A')
-                    channel_views = int(channel['statistics'].get('viewCount', 0))
-                    channel_description = channel['snippet'].get('description', 'N/A')
-                    channel_status = channel['status'].get('privacyStatus', 'N/A')
-
-                    channels.append({
-                        'channel_id': channel_id,
-                        'channel_name': channel_name,
-                        'channel_type': channel_type,
-                        'channel_views': channel_views,
-                        'channel_description': channel_description,
-                        'channel_status': channel_status
-                    })
-
-                    playlist_id = channel['contentDetails']['relatedPlaylists']['uploads']
-                    playlist_items = get_playlist_items(api_key, playlist_id)
-                    for item in playlist_items['items']:
-                        video_id = item['contentDetails']['videoId']
-                        video_details = get_video_details(api_key, [video_id])
-
-                        for video in video_details['items']:
-                            video_id = video['id']
-                            video_name = video['snippet']['title']
-                            video_description = video['snippet'].get('description', 'N/A')
-                            published_date = video['snippet']['publishedAt']
-                            view_count = video['statistics'].get('viewCount', 'N/A')
-                            like_count = video['statistics'].get('likeCount', 'N/A')
-                            dislike_count = video['statistics'].get('dislikeCount', 'N/A')
-                            favorite_count = video['statistics'].get('favoriteCount', 'N/A')
-                            comment_count = video['statistics'].get('commentCount', 'N/A')
-                            duration = isodate.parse_duration(video['contentDetails']['duration']).total_seconds()
-                            thumbnail = video['snippet']['thumbnails']['default']['url']
-                            caption_status = video['contentDetails'].get('caption', 'N/A')
-                            #comments
-
-                            videos.append({
-                                'video_id': video_id,
-                                'channel_id': channel_id,
-                                'playlist_id': playlist_id,
-                                'video_name': video_name,
-                                'video_description': video_description,
-                                'published_date': published_date,
-                                'view_count': view_count,
-                                'like_count': like_count,
-                                'dislike_count': dislike_count,
-                                'favorite_count': favorite_count,
-                                'comment_count': comment_count,
-                                'duration': duration,
-                                'thumbnail': thumbnail,
-                                'caption_status': caption_status
-                            })
-
-                        playlists.append({
-                            'playlist_id': playlist_id,
-                            'channel_id': channel_id,
-                            'playlist_name': 'Uploads'
-                        })
-
-                comments = get_comments(api_key, channel_ids)
-                store_data_in_mysql(channels, playlists, videos, comments)
+                try:
+                    job = start_ingest_job(api_key, channel_ids, workers, incremental, recency_days)
+                    st.success(f"Started ingest job {job['job_id']}")
+                except JobLockedError as e:
+                    st.warning(str(e))
             else:
                 st.error("Please enter both YouTube Data API key and channel IDs.")
 
+        show_ingest_jobs(api_key)
+
     elif app_mode == 'Analysis':
         st.header("Data Analysis")
 
         # Run queries and display results
         run_queries_and_display()
 
+    elif app_mode == 'Search':
+        show_search_page()
+
+    elif app_mode == 'Diagnostics':
+        show_diagnostics()
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
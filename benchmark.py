@@ -0,0 +1,281 @@
+"""Measure ingest throughput and analysis query latency without a YouTube API key or a database server.
+
+    python benchmark.py [--channels 5] [--videos-per-channel 500] [--comments-per-video 20]
+                        [--replies-per-comment 2] [--latency-ms 0] [--workers 4]
+                        [--backend duckdb|mysql] [--query-repeats 5] [--trace-memory]
+                        [--label NAME] [--output FILE]
+
+YouTube Data API calls are answered by a local fake that serves synthetic channels, paginated playlists,
+video batches and comment threads. The duckdb backend writes to a throwaway directory; the mysql backend
+uses the MYSQL_* settings, so point MYSQL_DATABASE at a scratch database. The report is JSON, so runs of
+different versions can be compared.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlsplit
+
+import httplib2
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import App
+
+BENCHMARK_API_KEY = 'benchmark'
+FAKE_EPOCH = datetime(2024, 1, 1)
+EMBEDDED_REPLIES = 5  # commentThreads returns at most this many replies per thread
+
+
+class MemoryTracker:
+    # Python allocations through tracemalloc (slows the run down a lot, so only on request), and the
+    # process peak RSS, which also covers DuckDB and Arrow buffers
+    def __init__(self, trace):
+        self.trace = trace
+
+    def __enter__(self):
+        if self.trace:
+            tracemalloc.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.python_peak_bytes = tracemalloc.get_traced_memory()[1] if self.trace else None
+        if self.trace:
+            tracemalloc.stop()
+
+    def report(self):
+        peak_rss = None
+        if resource is not None:
+            # ru_maxrss is in kilobytes on Linux and bytes on macOS
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        return {'python_peak_bytes': self.python_peak_bytes, 'process_peak_rss_bytes': peak_rss}
+
+
+class FakeYouTubeHttp:
+    # Stands in for httplib2.Http; the same data is generated for the same ids on every call
+    def __init__(self, videos_per_channel, comments_per_video, replies_per_comment, latency):
+        self.videos_per_channel = videos_per_channel
+        self.comments_per_video = comments_per_video
+        self.replies_per_comment = replies_per_comment
+        self.latency = latency
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        parts = urlsplit(uri)
+        endpoint = parts.path.rsplit('/', 1)[-1]
+        params = {name: values[0] for name, values in parse_qs(parts.query).items()}
+        with self._lock:
+            self.calls[endpoint] += 1
+
+        handler = getattr(self, f'_{endpoint}', None)
+        if handler is None:
+            return httplib2.Response({'status': 404}), b'{}'
+        payload = handler(params)
+        payload.setdefault('etag', f'"{endpoint}-{len(payload.get("items", []))}"')
+        return (httplib2.Response({'status': 200, 'content-type': 'application/json; charset=UTF-8'}),
+                json.dumps(payload).encode('utf-8'))
+
+    def close(self):
+        pass
+
+    def _page(self, params, total, page_size):
+        start = int(params.get('pageToken') or 0)
+        end = min(total, start + min(int(params.get('maxResults', page_size)), page_size))
+        return range(start, end), (str(end) if end < total else None)
+
+    def _paged(self, items, next_page_token):
+        payload = {'items': items}
+        if next_page_token:
+            payload['nextPageToken'] = next_page_token
+        return payload
+
+    @staticmethod
+    def _timestamp(hours):
+        return (FAKE_EPOCH + timedelta(hours=hours)).strftime(App.API_DATETIME_FORMAT)
+
+    def _channels(self, params):
+        return {'items': [{
+            'id': channel_id,
+            'snippet': {'title': f'Channel {channel_id}', 'description': f'Synthetic channel {channel_id}'},
+            'statistics': {'viewCount': str(self.videos_per_channel * 1000)},
+            'status': {'privacyStatus': 'public'},
+            'contentDetails': {'relatedPlaylists': {'uploads': 'UU' + channel_id[2:]}}
+        } for channel_id in params['id'].split(',')]}
+
+    def _playlistItems(self, params):
+        channel_id = 'UC' + params['playlistId'][2:]
+        indexes, next_page_token = self._page(params, self.videos_per_channel, 50)
+        # Uploads playlists list the newest video first
+        return self._paged([{
+            'contentDetails': {'videoId': f'{channel_id}-v{number:06d}',
+                               'videoPublishedAt': self._timestamp(number)}
+        } for number in (self.videos_per_channel - 1 - index for index in indexes)], next_page_token)
+
+    def _videos(self, params):
+        items = []
+        for video_id in params['id'].split(','):
+            number = int(video_id.rsplit('-v', 1)[1])
+            items.append({
+                'id': video_id,
+                'snippet': {'title': f'Video {number}', 'description': f'Synthetic video {video_id} ' * 4,
+                            'publishedAt': self._timestamp(number),
+                            'thumbnails': {'default': {'url': f'https://i.ytimg.com/vi/{video_id}/default.jpg'}}},
+                'statistics': {'viewCount': str(number * 37 % 100000), 'likeCount': str(number * 7 % 5000),
+                               'dislikeCount': str(number % 50), 'favoriteCount': '0',
+                               'commentCount': str(self.comments_per_video * (1 + self.replies_per_comment))},
+                'contentDetails': {'duration': f'PT{number % 60}M{number % 59}S', 'caption': 'false'}
+            })
+        return {'items': items}
+
+    def _comment(self, comment_id, number):
+        return {'id': comment_id,
+                'snippet': {'textDisplay': f'Synthetic comment {comment_id}', 'authorDisplayName': f'user{number}',
+                            'publishedAt': self._timestamp(number)}}
+
+    def _replies(self, parent_id, indexes):
+        return [self._comment(f'{parent_id}.r{index}', index) for index in indexes]
+
+    def _commentThreads(self, params):
+        video_id = params['videoId']
+        indexes, next_page_token = self._page(params, self.comments_per_video, 100)
+        threads = []
+        for index in indexes:
+            comment_id = f'{video_id}-c{index:05d}'
+            threads.append({'id': comment_id,
+                            'snippet': {'topLevelComment': self._comment(comment_id, index),
+                                        'totalReplyCount': self.replies_per_comment},
+                            'replies': {'comments': self._replies(
+                                comment_id, range(min(self.replies_per_comment, EMBEDDED_REPLIES)))}})
+        return self._paged(threads, next_page_token)
+
+    def _comments(self, params):
+        indexes, next_page_token = self._page(params, self.replies_per_comment, 100)
+        return self._paged(self._replies(params['parentId'], indexes), next_page_token)
+
+
+def create_backend(name, work_dir):
+    if name == 'duckdb':
+        return App.ParquetBackend(os.path.join(work_dir, 'parquet'))
+    return App.MySQLBackend()
+
+
+def run_ingest(backend, fake_http, channel_ids, workers, trace_memory):
+    # The same path as a job started from the Fetch and Store page, run in this process
+    limiter = App.get_quota_limiter(BENCHMARK_API_KEY)
+    quota_before = limiter.used_today
+    job = App.create_job(BENCHMARK_API_KEY, channel_ids, workers, False, App.DEFAULT_RECENCY_WINDOW_DAYS)
+
+    with MemoryTracker(trace_memory) as memory:
+        started = time.perf_counter()
+        job = App.run_ingest_job(job['job_id'], BENCHMARK_API_KEY)
+        seconds = time.perf_counter() - started
+
+    rows = job['stored_videos'] + job['stored_comments']
+    return {
+        'seconds': round(seconds, 3),
+        'api_calls': dict(fake_http.calls, total=sum(fake_http.calls.values())),
+        'quota_units': limiter.used_today - quota_before,
+        'stored_videos': job['stored_videos'],
+        'stored_comments': job['stored_comments'],
+        'rows_per_second': round(rows / seconds, 1) if seconds else None,
+        'memory': memory.report()
+    }
+
+
+def time_call(call, repeats, measure=len, unit='rows'):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = call()
+        timings.append(time.perf_counter() - started)
+        size = measure(result)
+    return {unit: size, 'min_ms': round(min(timings) * 1000, 3),
+            'median_ms': round(statistics.median(timings) * 1000, 3), 'max_ms': round(max(timings) * 1000, 3)}
+
+
+def run_queries(backend, repeats, trace_memory):
+    # The calls the Analysis page makes: paged queries are never loaded in full there, but shown a page
+    # at a time next to a top-N chart, with the full result only streamed to a CSV download
+    results = {}
+    with MemoryTracker(trace_memory) as memory:
+        for query_name in App.ANALYSIS_QUERIES:
+            if query_name not in App.PAGED_QUERIES:
+                results[query_name] = time_call(lambda: backend.run_query(query_name), repeats)
+                continue
+            results[query_name] = {
+                'first_page': time_call(lambda: App.fetch_page(backend, query_name, None, App.PAGE_SIZES[1]),
+                                        repeats),
+                'chart': time_call(lambda: App.fetch_chart_data(backend, query_name), repeats),
+                'csv': time_call(lambda: App.write_query_csv(backend, query_name), repeats, unit='bytes')
+            }
+    return {'memory': memory.report(), 'queries': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest and query benchmark against a fake YouTube Data API")
+    parser.add_argument('--channels', type=int, default=5)
+    parser.add_argument('--videos-per-channel', type=int, default=500)
+    parser.add_argument('--comments-per-video', type=int, default=20, help="top-level comments per video")
+    parser.add_argument('--replies-per-comment', type=int, default=2)
+    parser.add_argument('--latency-ms', type=float, default=0, help="simulated latency of every API call")
+    parser.add_argument('--workers', type=int, default=App.DEFAULT_FETCH_WORKERS)
+    parser.add_argument('--backend', choices=sorted(App.STORAGE_BACKENDS), default='duckdb')
+    parser.add_argument('--query-repeats', type=int, default=5)
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="also measure peak Python allocations with tracemalloc (much slower)")
+    parser.add_argument('--label', help="name of this run in the report, e.g. a git revision")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    fake_http = FakeYouTubeHttp(args.videos_per_channel, args.comments_per_video, args.replies_per_comment,
+                                args.latency_ms / 1000)
+    channel_ids = [f'UCbench{number:06d}' for number in range(args.channels)]
+
+    with tempfile.TemporaryDirectory(prefix='youtube-benchmark-') as work_dir:
+        # Cold response cache, job state out of the way, and no quota pacing - only the fake is being called
+        App.RESPONSE_CACHE_PATH = os.path.join(work_dir, 'responses.sqlite3')
+        App.INGEST_JOB_DIR = os.path.join(work_dir, 'jobs')
+        App.YOUTUBE_DAILY_QUOTA = sys.maxsize
+        App.YOUTUBE_UNITS_PER_SECOND = 1e9
+        App.get_thread_http = lambda: fake_http
+        backend = create_backend(args.backend, work_dir)
+        App.get_storage_backend = lambda name=None: backend
+
+        report = {
+            'label': args.label,
+            'created_at': App.utc_now().isoformat(),
+            'python': platform.python_version(),
+            'config': {key: value for key, value in vars(args).items() if key not in ('label', 'output')},
+            'ingest': run_ingest(backend, fake_http, channel_ids, args.workers, args.trace_memory),
+            'analysis': run_queries(backend, args.query_repeats, args.trace_memory),
+            # Where the time went: API, database and pipeline stage latency histograms
+            'metrics': App.get_metrics().snapshot()
+        }
+        App.get_response_cache()._connection.close()
+        App.get_quota_ledger()._connection.close()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as report_file:
+            report_file.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""Run the fetch-and-store ingest outside the Streamlit script run.
+
+    python ingest_job.py start --channels UC...,UC... [--workers 4] [--full] [--recency-days 7]
+    python ingest_job.py run JOB_ID
+    python ingest_job.py resume JOB_ID
+    python ingest_job.py schedule --channels UC...,UC... --interval 3600
+    python ingest_job.py status [JOB_ID]
+
+The YouTube Data API key is read from the YOUTUBE_API_KEY environment variable.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import App
+
+
+def get_api_key():
+    api_key = os.environ.get('YOUTUBE_API_KEY')
+    if not api_key:
+        sys.exit("Set the YOUTUBE_API_KEY environment variable to the YouTube Data API v3 key.")
+    return api_key
+
+
+def parse_channel_ids(value):
+    return [channel_id.strip() for channel_id in value.split(',') if channel_id.strip()]
+
+
+def run_job(job_id, api_key):
+    try:
+        job = App.run_ingest_job(job_id, api_key)
+    except App.JobLockedError as e:
+        print(e, file=sys.stderr)
+        return 2
+    except Exception as e:
+        print(f"Job {job_id} failed: {type(e).__name__}: {e}", file=sys.stderr)
+        return 1
+    print(f"Job {job_id} finished: {job['stored_videos']} videos, {job['stored_comments']} comments, "
+          f"{job['quota_units_used']} quota units")
+    return 0
+
+
+def schedule(api_key, channel_ids, interval, workers, incremental, recency_days):
+    channel_set = App.channel_set_key(channel_ids)
+    while True:
+        # Resume the last run of this channel set if it did not finish, otherwise start a new one
+        previous = [job for job in App.list_jobs(limit=None) if job['channel_set'] == channel_set]
+        if previous and App.job_status(previous[0]) in ('failed', 'interrupted'):
+            job_id = previous[0]['job_id']
+        else:
+            job_id = App.create_job(api_key, channel_ids, workers, incremental, recency_days)['job_id']
+        run_job(job_id, api_key)
+        time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Background ingest jobs for the YouTube Channel Data Analysis app")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    for name in ('start', 'schedule'):
+        command = commands.add_parser(name)
+        command.add_argument('--channels', required=True, help="comma-separated YouTube channel ids")
+        command.add_argument('--workers', type=int, default=App.DEFAULT_FETCH_WORKERS)
+        command.add_argument('--full', action='store_true', help="fetch every upload instead of an incremental sync")
+        command.add_argument('--recency-days', type=int, default=App.DEFAULT_RECENCY_WINDOW_DAYS)
+    commands.choices['schedule'].add_argument('--interval', type=int, required=True, help="seconds between runs")
+    commands.add_parser('run').add_argument('job_id')
+    commands.add_parser('resume').add_argument('job_id')
+    commands.add_parser('status').add_argument('job_id', nargs='?')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'status':
+        jobs = [App.load_job(args.job_id)] if args.job_id else App.list_jobs()
+        for job in jobs:
+            job['status'] = App.job_status(job)
+        print(json.dumps(jobs, indent=2))
+        return 0
+
+    api_key = get_api_key()
+    if args.command == 'start':
+        job = App.create_job(api_key, parse_channel_ids(args.channels), args.workers, not args.full,
+                             args.recency_days)
+        print(f"Started job {job['job_id']}")
+        return run_job(job['job_id'], api_key)
+    if args.command in ('run', 'resume'):
+        return run_job(args.job_id, api_key)
+    if args.command == 'schedule':
+        schedule(api_key, parse_channel_ids(args.channels), args.interval, args.workers, not args.full,
+                 args.recency_days)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())